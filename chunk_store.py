@@ -0,0 +1,561 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import numpy.ma as ma
+from netCDF4 import Dataset, default_fillvals
+import itertools
+import json
+import os
+import shutil
+import argparse
+
+class ChunkStore(object):
+    '''
+    Output backend which writes the variables into a chunked
+    directory store (Zarr v2 layout on the local filesystem,
+    uncompressed). Every chunk is a file of its own which is
+    written to a temporary file and renamed, so several
+    processes can write different chunks of the same store
+    at the same time without locks (E.g. the tiles of a
+    sharded run, see NcManager.enableChunkStore()). The
+    metadata is written once when the store is created, the
+    writers open the store with mode "a". The variables are
+    stored in directories with encoded names (see toDirName()),
+    the real names are kept in the attributes. The store can
+    be converted to a netCDF file with toNetCDF().
+
+    The class mimics the part of the netCDF4.Dataset interface
+    which is used for writing the output file.
+    '''
+    def __init__(self, path, mode="r", chunks=None):
+        '''
+        Parameters
+        ----------
+        path : string
+            The directory of the store
+        mode : string
+            "w" creates the store (an existing store is
+            removed), "a" and "r" open an existing store
+        chunks : tuple
+            The chunk size (cy, cx) of the spatial dimensions.
+            Other dimensions of spatial variables are chunked
+            by 1, all other variables are stored in one chunk.
+
+        Attributes
+        ----------
+        dimensions : dict
+            The dimension sizes
+        unlimited : list
+            The dimensions which are unlimited in the netCDF file
+        variables : dict
+            The ChunkStoreVariables per name
+        '''
+        self.path = path
+        self.chunks = chunks
+        self.dimensions = {}
+        self.unlimited = []
+        self.variables = {}
+        self.attrs = {}
+
+        if mode == "w":
+            self.__clear()
+            makeDirs(path)
+            self.writeJson(".zgroup", {"zarr_format": 2})
+            self.__saveMeta()
+        else:
+            self.__load()
+
+
+    def __clear(self):
+        '''
+        Removes an existing store with all its chunks. Other 
+        directories are not touched.
+        '''
+        if not os.path.exists(self.path):
+            return
+            
+        if not os.path.exists(os.path.join(self.path, ".zgroup")):
+            if os.listdir(self.path):
+                raise IOError("'" + self.path + "' exists and is not a chunk store.")
+            return
+            
+        shutil.rmtree(self.path)
+
+
+    def __load(self):
+        '''
+        Loads the metadata of an existing store.
+        '''
+        if not os.path.exists(os.path.join(self.path, ".zgroup")):
+            raise IOError("'" + self.path + "' is not a chunk store.")
+
+        meta = self.readJson(".zdims")
+        self.dimensions = meta["dimensions"]
+        self.unlimited = meta["unlimited"]
+        self.chunks = meta["chunks"]
+        self.attrs = self.readJson(".zattrs")
+
+        for dirName in sorted(os.listdir(self.path)):
+            if os.path.exists(os.path.join(self.path, dirName, ".zarray")):
+                variable = ChunkStoreVariable(self, dirName)
+                self.variables[variable.name] = variable
+
+
+    def readJson(self, relPath):
+        with open(os.path.join(self.path, relPath), "r") as f:
+            return json.load(f)
+
+
+    def writeJson(self, relPath, obj):
+        '''
+        Writes a metadata file atomically. Concurrent writers
+        write identical metadata.
+        '''
+        path = os.path.join(self.path, relPath)
+        tmpPath = path + "." + str(os.getpid()) + ".tmp"
+
+        with open(tmpPath, "w") as f:
+            json.dump(obj, f, indent=1, sort_keys=True, default=toJson)
+
+        replaceFile(tmpPath, path)
+
+
+    def __saveMeta(self):
+        self.writeJson(".zdims", {"dimensions": self.dimensions, "unlimited": self.unlimited, "chunks": self.chunks})
+        self.writeJson(".zattrs", self.attrs)
+
+
+    def createDimension(self, name, size, unlimited=False):
+        '''
+        Creates a dimension. The store has no unlimited
+        dimensions, unlimited dimensions are only marked as
+        such for the conversion to netCDF.
+        '''
+        if size is None:
+            raise ValueError("Dimension '" + name + "' needs a size in a chunk store.")
+
+        self.dimensions[name] = int(size)
+
+        if unlimited and name not in self.unlimited:
+            self.unlimited.append(name)
+
+        self.__saveMeta()
+
+
+    def createVariable(self, varname, datatype, dimensions, fill_value=None):
+        '''
+        Creates a variable (array) in the store.
+        '''
+        if isinstance(dimensions, str):
+            dimensions = (dimensions,)
+
+        dtype = np.dtype(datatype)
+        shape = [self.dimensions[d] for d in dimensions]
+        spatial = "y" in dimensions or "x" in dimensions
+        chunks = []
+
+        for dim, size in zip(dimensions, shape):
+            if dim == "y" and self.chunks:
+                chunks.append(min(self.chunks[0], size))
+            elif dim == "x" and self.chunks:
+                chunks.append(min(self.chunks[1], size))
+            elif spatial and dim not in ("y", "x"):
+                chunks.append(1)
+            else:
+                chunks.append(max(size, 1))
+
+        fill = fill_value if fill_value is not None else default_fillvals.get(dtype.str[1:])
+        attrs = {"_ARRAY_DIMENSIONS": list(dimensions), "_NC_NAME": varname}
+        dirName = toDirName(varname)
+
+        if fill_value is not None:
+            attrs["_FillValue"] = fill_value
+
+        makeDirs(os.path.join(self.path, dirName))
+        self.writeJson(os.path.join(dirName, ".zarray"), {"zarr_format": 2, "shape": shape, "chunks": chunks, "dtype": dtype.newbyteorder("<").str,
+                                                         "fill_value": toJsonFill(fill), "order": "C", "compressor": None, "filters": None})
+        self.writeJson(os.path.join(dirName, ".zattrs"), attrs)
+        self.variables[varname] = ChunkStoreVariable(self, dirName)
+
+        return self.variables[varname]
+
+
+    def ncattrs(self):
+        return list(self.attrs)
+
+
+    def getncattr(self, name):
+        return self.attrs[name]
+
+
+    def setncattr(self, name, value):
+        self.attrs[name] = value
+        self.__saveMeta()
+
+
+    def setncatts(self, attrs):
+        self.attrs.update(attrs)
+        self.__saveMeta()
+
+
+    def sync(self):
+        '''
+        Nothing to do, every chunk is on disk after writing.
+        '''
+        pass
+
+
+    def close(self):
+        pass
+
+
+    def toNetCDF(self, ncPath):
+        '''
+        Converts the store to a netCDF file with the same
+        dimensions, variables (E.g. "asmh_[mean]") and
+        attributes (E.g. the time_bnds metadata). Chunks
+        which were never written are filled with the fill
+        value. Spatial variables are copied step by step
+        along their leading dimension to bound the memory.
+
+        Parameters
+        ----------
+        ncPath : string
+            The path of the netCDF file
+        '''
+        dst = Dataset(ncPath, "w", format="NETCDF4")
+
+        try:
+            dst.setncatts(self.attrs)
+
+            for name, size in sorted(self.dimensions.items()):
+                dst.createDimension(name, None if name in self.unlimited else size)
+
+            # Coordinates first, like in the output files of the NcManager
+            names = sorted(self.variables, key=lambda n: (n not in ("time", "time_bnds", "x", "y"), n))
+
+            for name in names:
+                variable = self.variables[name]
+                attrs = dict((k, variable.getncattr(k)) for k in variable.ncattrs())
+                fill = attrs.pop("_FillValue", None)
+
+                if fill is not None:
+                    fill = np.array(fill, dtype=variable.dtype)
+
+                varOut = dst.createVariable(name, variable.dtype, variable.dimensions, fill_value=fill)
+                varOut.setncatts(attrs)
+
+                # The packed values are copied as they are
+                varOut.set_auto_maskandscale(False)
+                variable.set_auto_maskandscale(False)
+
+                try:
+                    if variable.ndim > 1 and variable.chunkShape[0] == 1:
+                        for step in range(variable.shape[0]):
+                            varOut[step] = variable[step]
+                    elif variable.ndim > 0:
+                        varOut[:] = variable[:]
+                finally:
+                    variable.set_auto_maskandscale(True)
+        finally:
+            dst.close()
+
+
+class ChunkStoreVariable(object):
+    '''
+    A variable (array) of a ChunkStore. Supports writing
+    and reading with integer and slice indexes.
+    '''
+    def __init__(self, store, dirName):
+        meta = store.readJson(os.path.join(dirName, ".zarray"))
+        attrs = store.readJson(os.path.join(dirName, ".zattrs"))
+
+        self.__dict__["_store"] = store
+        self.__dict__["_dirName"] = dirName
+        self.__dict__["_name"] = attrs.pop("_NC_NAME", dirName)
+        self.__dict__["_dimensions"] = tuple(attrs.pop("_ARRAY_DIMENSIONS"))
+        self.__dict__["_attrs"] = attrs
+        self.__dict__["_dtype"] = np.dtype(meta["dtype"])
+        self.__dict__["_shape"] = tuple(meta["shape"])
+        self.__dict__["_chunks"] = tuple(meta["chunks"])
+        self.__dict__["_fill"] = fromJsonFill(meta["fill_value"], self._dtype)
+        self.__dict__["_maskAndScale"] = True
+
+    name = property(lambda self: self._name)
+    dimensions = property(lambda self: self._dimensions)
+    dtype = property(lambda self: self._dtype)
+    datatype = dtype
+    shape = property(lambda self: self._shape)
+    ndim = property(lambda self: len(self._shape))
+    chunkShape = property(lambda self: self._chunks)
+
+
+    def __getattr__(self, name):
+        try:
+            return self.__dict__["_attrs"][name]
+        except KeyError:
+            raise AttributeError(name)
+
+
+    def __setattr__(self, name, value):
+        self.setncattr(name, value)
+
+
+    def ncattrs(self):
+        return list(self._attrs)
+
+
+    def getncattr(self, name):
+        return self._attrs[name]
+
+
+    def setncattr(self, name, value):
+        self._attrs[name] = value
+        self.__saveAttrs()
+
+
+    def setncatts(self, attrs):
+        self._attrs.update(attrs)
+        self.__saveAttrs()
+
+
+    def set_auto_maskandscale(self, flag):
+        '''
+        Turns the packing of the values of packed variables
+        (scale_factor, add_offset) on writing and the 
+        unpacking on reading on or off, like for a netCDF4
+        variable.
+        '''
+        self.__dict__["_maskAndScale"] = bool(flag)
+
+
+    def __isPacked(self):
+        return self._maskAndScale and ("scale_factor" in self._attrs or "add_offset" in self._attrs)
+
+
+    def __pack(self, data):
+        '''
+        Converts the values to the datatype of the variable.
+        Values of packed variables are packed like netCDF4
+        does it, round((x - add_offset) / scale_factor) for
+        integer types. Masked and nan values are set to the
+        fill value.
+        '''
+        if not self.__isPacked():
+            if ma.isMaskedArray(data):
+                data = data.astype(self._dtype).filled(self._fill)
+                
+            return np.asarray(data, dtype=self._dtype)
+            
+        scale = float(self._attrs.get("scale_factor", 1.0))
+        offset = float(self._attrs.get("add_offset", 0.0))
+        values = ma.asarray((ma.masked_invalid(ma.asarray(data, dtype=np.float64)) - offset) / scale)
+        
+        if self._dtype.kind in "iu":
+            values = ma.asarray(ma.round(values))
+            valid = values.compressed()
+            info = np.iinfo(self._dtype)
+            
+            if valid.size and (valid.min() < info.min or valid.max() > info.max):
+                raise ValueError("Values of '" + self._name + "' are out of the range of the packed datatype " + str(self._dtype) + 
+                                 " (scale_factor " + str(scale) + ", add_offset " + str(offset) + ").")
+                
+        return values.astype(self._dtype).filled(self._fill)
+
+
+    def __unpack(self, data):
+        '''
+        Unpacks the values of packed variables, fill values
+        are masked.
+        '''
+        if not self.__isPacked():
+            return data
+            
+        scale = float(self._attrs.get("scale_factor", 1.0))
+        offset = float(self._attrs.get("add_offset", 0.0))
+        
+        return ma.masked_array(data * scale + offset, mask=data == self._fill)
+
+
+    def __saveAttrs(self):
+        attrs = dict(self._attrs)
+        attrs["_ARRAY_DIMENSIONS"] = list(self._dimensions)
+        attrs["_NC_NAME"] = self._name
+        self._store.writeJson(os.path.join(self._dirName, ".zattrs"), attrs)
+
+
+    def __normalize(self, idx):
+        '''
+        Converts an index to a list of (start, stop) per
+        dimension and the dimensions indexed by integers.
+        '''
+        if not isinstance(idx, tuple):
+            idx = (idx,)
+
+        idx = idx + (slice(None),) * (self.ndim - len(idx))
+        bounds = []
+        squeeze = []
+
+        for dim, (i, size) in enumerate(zip(idx, self._shape)):
+            if isinstance(i, slice):
+                start, stop, step = i.indices(size)
+
+                if step != 1:
+                    raise IndexError("Strided access is not supported by the chunk store.")
+
+                bounds.append((start, max(start, stop)))
+            else:
+                i = int(i)
+                i = i + size if i < 0 else i
+
+                if not 0 <= i < size:
+                    raise IndexError("Index " + str(i) + " out of bounds of dimension '" + self._dimensions[dim] + "'")
+
+                bounds.append((i, i + 1))
+                squeeze.append(dim)
+
+        return bounds, squeeze
+
+
+    def __chunkPath(self, chunkIdx):
+        return os.path.join(self._store.path, self._dirName, ".".join(str(c) for c in chunkIdx))
+
+
+    def __chunkRegions(self, bounds):
+        '''
+        Yields the index of every chunk which intersects the
+        bounds, with the intersection in array coordinates.
+        '''
+        ranges = [range(start // c, (stop - 1) // c + 1) if stop > start else [] for (start, stop), c in zip(bounds, self._chunks)]
+
+        for chunkIdx in itertools.product(*ranges):
+            region = [(max(start, ci * c), min(stop, (ci + 1) * c)) for (start, stop), ci, c in zip(bounds, chunkIdx, self._chunks)]
+            yield chunkIdx, region
+
+
+    def __readChunk(self, chunkIdx):
+        path = self.__chunkPath(chunkIdx)
+
+        if os.path.exists(path):
+            return np.fromfile(path, dtype=self._dtype.newbyteorder("<")).reshape(self._chunks).astype(self._dtype)
+
+        return np.full(self._chunks, self._fill, dtype=self._dtype)
+
+
+    def __setitem__(self, idx, data):
+        bounds, squeeze = self.__normalize(idx)
+        shape = [stop - start for start, stop in bounds]
+        keptShape = [s for dim, s in enumerate(shape) if dim not in squeeze]
+
+        data = np.broadcast_to(self.__pack(data), keptShape).reshape(shape)
+
+        for chunkIdx, region in self.__chunkRegions(bounds):
+            chunkStart = [ci * c for ci, c in zip(chunkIdx, self._chunks)]
+            full = all(start == cs and (stop == cs + c or stop == size) for (start, stop), cs, c, size in zip(region, chunkStart, self._chunks, self._shape))
+
+            # Only partly covered chunks have to be read (read-modify-write)
+            chunk = np.full(self._chunks, self._fill, dtype=self._dtype) if full else self.__readChunk(chunkIdx)
+
+            dstIdx = tuple(slice(start - cs, stop - cs) for (start, stop), cs in zip(region, chunkStart))
+            srcIdx = tuple(slice(start - b[0], stop - b[0]) for (start, stop), b in zip(region, bounds))
+            chunk[dstIdx] = data[srcIdx]
+
+            path = self.__chunkPath(chunkIdx)
+            tmpPath = path + "." + str(os.getpid()) + ".tmp"
+            np.ascontiguousarray(chunk, dtype=self._dtype.newbyteorder("<")).tofile(tmpPath)
+            replaceFile(tmpPath, path)
+
+
+    def __getitem__(self, idx):
+        bounds, squeeze = self.__normalize(idx)
+        shape = [stop - start for start, stop in bounds]
+        data = np.full(shape, self._fill, dtype=self._dtype)
+
+        for chunkIdx, region in self.__chunkRegions(bounds):
+            chunkStart = [ci * c for ci, c in zip(chunkIdx, self._chunks)]
+            srcIdx = tuple(slice(start - cs, stop - cs) for (start, stop), cs in zip(region, chunkStart))
+            dstIdx = tuple(slice(start - b[0], stop - b[0]) for (start, stop), b in zip(region, bounds))
+            data[dstIdx] = self.__readChunk(chunkIdx)[srcIdx]
+
+        return self.__unpack(data.reshape([s for dim, s in enumerate(shape) if dim not in squeeze]))
+
+
+def toDirName(name):
+    '''
+    Encodes a variable name as a directory name which is
+    valid on all platforms. Characters other than letters,
+    digits and "_-[]()" are percent-encoded 
+    (E.g. "sweosasm_[count_>_90]" -> "sweosasm_[count_%3E_90]").
+    '''
+    return "".join(c if c.isalnum() or c in "_-[]()" else "%%%02X" % ord(c) for c in name)
+
+
+def makeDirs(path):
+    '''
+    Creates a directory if it does not exist (it may be
+    created by another writer at the same time).
+    '''
+    if not os.path.isdir(path):
+        try:
+            os.makedirs(path)
+        except OSError:
+            if not os.path.isdir(path):
+                raise
+
+
+def replaceFile(src, dst):
+    '''
+    Renames a file and replaces the destination (os.rename
+    does not replace existing files on Windows).
+    '''
+    try:
+        os.rename(src, dst)
+    except OSError:
+        os.remove(dst)
+        os.rename(src, dst)
+
+
+def toJson(obj):
+    '''
+    Converts numpy types of attributes to json types.
+    '''
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+
+    raise TypeError(repr(obj) + " is not JSON serializable")
+
+
+def toJsonFill(fill):
+    '''
+    Encodes a fill value for the .zarray metadata ("NaN"
+    and "Infinity" as strings).
+    '''
+    if fill is None:
+        return None
+
+    fill = np.asarray(fill).item()
+
+    if isinstance(fill, float) and not np.isfinite(fill):
+        return "NaN" if np.isnan(fill) else ("Infinity" if fill > 0 else "-Infinity")
+
+    return fill
+
+
+def fromJsonFill(fill, dtype):
+    if fill is None:
+        return np.zeros((), dtype=dtype)[()]
+
+    return np.array(float(fill) if fill in ("NaN", "Infinity", "-Infinity") else fill, dtype=dtype)[()]
+
+
+if __name__== "__main__":
+    parser = argparse.ArgumentParser(description="Converts a chunk store output to a netCDF file.")
+    parser.add_argument("store", help="Directory of the chunk store")
+    parser.add_argument("output", help="Path of the netCDF file")
+    args = parser.parse_args()
+
+    ChunkStore(args.store, "r").toNetCDF(args.output)
+    print("Converted " + args.store + " to " + args.output)
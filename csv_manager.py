@@ -3,6 +3,7 @@
 
 import pandas as pd
 import time
+import os
 
 class CsvManager(object):
     '''
@@ -84,11 +85,17 @@ class CsvManager(object):
         return timespanStrs
  
         
-    def writeDataToFile(self):
+    def writeDataToFile(self, append=False):
         '''
         Finally writes the data to a csv file.
         First an dataframe is created of the
         data arrays.
+        
+        Parameters
+        ----------
+        append : bool
+            If True the rows are appended to existing 
+            csv files (incremental mode)
         '''
         collector = self.collector
         
@@ -106,7 +113,12 @@ class CsvManager(object):
                     
                 df = df.rename(index=str, columns={colName: frame[colName]["long_name"] + unitSep + frame[colName]["units"]})
 
-            df.to_csv(self.workingDir + frame["fileName"] + ".csv", index=False)
+            path = self.workingDir + frame["fileName"] + ".csv"
+            
+            if append and os.path.exists(path):
+                df.to_csv(path, index=False, mode="a", header=False)
+            else:
+                df.to_csv(path, index=False)
     
     
     def collectValues(self, varName, val, point):
@@ -123,4 +135,40 @@ class CsvManager(object):
             Point instance
         '''
         varValContainer = self.collector[id(point)][varName]["data"] 
-        varValContainer.append(val)
\ No newline at end of file
+        varValContainer.append(val)
+        
+        
+    def getPartials(self):
+        '''
+        Returns the values collected so far, keyed by 
+        the point file names, e.g. for checkpointing.
+        
+        Returns
+        ----------
+        partials : dict
+            {fileName: {varName: [values]}}
+        '''
+        partials = {}
+        
+        for pointId in self.collector:
+            frame = self.collector[pointId]
+            partials[frame["fileName"]] = {k: list(v["data"]) for k, v in frame.items() if isinstance(v, dict) and k != "timestep"}
+            
+        return partials
+        
+        
+    def setPartials(self, partials):
+        '''
+        Restores values collected in a previous run.
+        
+        Parameters
+        ----------
+        partials : dict
+            As returned by getPartials()
+        '''
+        for pointId in self.collector:
+            frame = self.collector[pointId]
+            
+            for varName, values in partials.get(frame["fileName"], {}).items():
+                if varName in frame:
+                    frame[varName]["data"] = list(values)
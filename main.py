@@ -16,7 +16,6 @@ for m in months:
     O_FILE_NAME = "2000_2100_"+ str(startMonth) + "_" + str(endMonth) + "_" + str(timespan) + "_rcp" + str(rcp)  + ".nc"
         
     nc_manager = NcManager(WORKING_DIR, "output_daily_rcp" + str(rcp) + ".nc", O_FILE_NAME)
-    #TODO: Works only if the usertimespan is equal to the timespan of the path !! CHANGE !!
     nc_manager.setTimeSpan("1980-01-01", "2100-12-31", period = [None,None,startMonth,endMonth,timespan])
     point_manager = PointManager()
     point_manager.createPoint(11,61)
@@ -31,7 +30,7 @@ for m in months:
                                             #{"var": "tasmin", "func": {"name": "mean", "props":[]}},
                                             #{"var": "emos", "func": {"name": "mean", "props":[]}},
                                             #{"var": "emos_nat", "func": {"name": "mean", "props":[]}},
-                                            #{"var": "pr", "func": {"name": "sum", "props":[]}},
+                                            #{"var": "pr", "func": {"name": "sum", "props":[]}, "resample": "sum"},
                                             #{"var": "paswe", "func": {"name": "sum", "props":[]}},
                                             #{"var": "sdasmos", "func": {"name": "mean", "props":[]}},
                                             #{"var": "sdnoasmos", "func": {"name": "mean", "props":[]}},
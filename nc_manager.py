@@ -3,12 +3,17 @@
 
 import numpy as np
 import pandas as pd
-from netCDF4 import Dataset
+from netCDF4 import Dataset, default_fillvals
 import warnings
 from helpers import *
 from datetime import *
 import calendar
 import numpy.ma as ma
+import pickle
+import os
+import threading
+from slab_cache import SlabCache
+from chunk_store import ChunkStore
 
 class NcManager(object):
     '''
@@ -39,6 +44,46 @@ class NcManager(object):
             Path were the output should be written  
         customTimeFlag : bool
             Flag to check if a timespan was set
+        incrementalFlag : bool
+            Flag to only calculate periods which are not yet 
+            in the output file
+        stepOffset : int
+            Number of periods already in the output file 
+            (incremental mode)
+        packedIOFlag : bool
+            Flag to reduce packed integers on the raw scale and 
+            to handle fill values with boolean masks
+        packOutputFlag : bool
+            Flag to write packed variables packed
+        window : tuple
+            The tile or index window (y0, y1, x0, x1) to analyse. None for 
+            the whole grid
+        tileFlag : bool
+            Flag if the window is a tile of a sharded run (see setTile())
+        stride : tuple
+            Only every (sy, sx)th cell of the window is read and analysed
+        activeCellsFlag : bool
+            Flag to only read and reduce the active (valid) cells
+        activeCells : ndarray
+            Flat indexes of the active cells within activeBox
+        activeBox : tuple
+            Bounding box (y0, y1, x0, x1) of the active cells
+        checkpointPath : string
+            Path of the checkpoint sidecar file (None if
+            checkpointing is disabled)
+        checkpoint : dict
+            The checkpoint with the completed (variable, step)
+            units and the csv partials
+        slabCache : slab_cache.SlabCache
+            Cache of the read slabs (None if caching is disabled)
+        ioLock : threading.RLock
+            Serializes the reads and writes of the netCDF library
+            (prefetching reads in a background thread)
+        chunkStoreFlag : bool
+            Flag to write the output to a chunked directory store
+            instead of a netCDF file
+        chunkStoreChunks : tuple
+            The spatial chunk size (cy, cx) of the chunk store
 
         ----------
         To better describe the attributes regarding to the
@@ -50,8 +95,21 @@ class NcManager(object):
 
         daysSince : datetime
             The date extracted from the "days since 1949-12-01 00:00:00" string 
+        timeUnit : string
+            The unit of the time axis as pandas timedelta unit ("D", "h", "m" or "s")
+        stepDates : ndarray
+            The datetimes of all time steps of the source file. Equals sourceDates
+            for daily data.
         sourceDates : ndarray
             All the dates of the source file as datetimes (2000-01-01 to 2100-12-31)
+        subDailyFlag : bool
+            True if the source has more than one time step per day. The data is then
+            resampled to daily values while reading (see resampleMethods)
+        dayStartSteps : ndarray
+            The index of the first time step of each day (plus the number of steps)
+        resampleMethods : dict
+            The resample method ("mean", "sum", "min", "max") per variable. Default
+            is "mean"
         allDaysSinceVec : ndarray
             All the dates since the files starting date (1949-12-01 to 2100-12-31) 
         sourceDatesIdx : pandas.Series 
@@ -67,7 +125,8 @@ class NcManager(object):
         userDateVec : ndarray
             All dates from the user defined timespan (2000-01-01 to 2011-12-31)
         boolDateVec : ndarray
-            A boolean date vector between user start and user end. 
+            A boolean date vector aligned with the source dates. True
+            for the dates to analyse.
         spanStartSpanEnd : ndarray
             Array with dicts of the user defined periods
             [{'startDate': Timestamp('2000-10-01 00:00:00'), 'endDate': Timestamp('2006-04-30 00:00:00'), 'endIdx': array([20604]), 'startIdx': array([18567])}]
@@ -84,10 +143,19 @@ class NcManager(object):
         self.setOutputPath(outputPath)
         self.varNamesToBeAnalysed = []
         self.daysSince = self.__setDaysSince(self.src.variables["time"])
-        self.sourceDates = self.__setSourceDates(self.src.variables["time"][:])
+        self.timeUnit = self.__setTimeUnit(self.src.variables["time"])
+        self.stepDates = self.__setSourceDates(self.src.variables["time"][:])
+        self.sourceDates, self.dayStartSteps = self.__setDailyDates(self.stepDates)
+        self.subDailyFlag = len(self.sourceDates) < len(self.stepDates)
+        self.resampleMethods = {}
+        self.resampleChunkDays = 31
         self.allDaysSinceVec = pd.date_range(self.daysSince, self.sourceDates[-1])
         self.sourceDatesIdx = self.__setSourceDatesIdx(self.sourceDates)
-        self.sourceDatesIdxAll = self.src.variables["time"][:]
+        
+        if self.subDailyFlag or self.timeUnit != "D":
+            self.sourceDatesIdxAll = np.asarray((self.sourceDates - self.daysSince.normalize()).days)
+        else:
+            self.sourceDatesIdxAll = self.src.variables["time"][:]
         self.srcStartDate = self.sourceDates[0]
         self.srcEndDate = self.sourceDates[-1]
         self.datesToAnalyse = []
@@ -99,6 +167,25 @@ class NcManager(object):
         self.end = None
         self.spanStartSpanEnd = None
         self.customTimeFlag = False
+        self.incrementalFlag = False
+        self.stepOffset = 0
+        self.pendingTimeBounds = np.empty((0,2))
+        self.packedIOFlag = False
+        self.packOutputFlag = False
+        self.window = None
+        self.tileFlag = False
+        self.stride = (1, 1)
+        self.activeCellsFlag = False
+        self.activeCells = None
+        self.activeBox = None
+        self.gridShape = None
+        self.checkpointFlag = False
+        self.checkpointPath = None
+        self.checkpoint = None
+        self.slabCache = None
+        self.ioLock = threading.RLock()
+        self.chunkStoreFlag = False
+        self.chunkStoreChunks = None
         
         
     def readData(self, working_dir, ncPath):
@@ -138,45 +225,104 @@ class NcManager(object):
         '''
         monthStart = period["monthStart"]
         monthEnd = period["monthEnd"]
+        dayStart = period.get("dayStart") or 1
+        dayEnd = period.get("dayEnd")
         yearRange = period["yearRange"]
         
-        userStartDate = pd.to_datetime(date(self.start.year, monthStart,1))
-        userEndDate = pd.to_datetime(date(self.end.year, monthEnd, calendar.monthrange(self.end.year, monthEnd)[1]))
+        # Season as month*100+day, e.g. 15 Nov - 15 Apr = 1115 - 415
+        seasonStart = monthStart * 100 + dayStart
+        seasonEnd = monthEnd * 100 + (dayEnd or 31)
+        wrapFlag = seasonStart > seasonEnd
+        
+        userStartDate = self.__createDates([self.start.year], monthStart, dayStart)[0]
+        userEndDate = self.__createDates([self.end.year], monthEnd, dayEnd)[0]
         
         datesToAnalyse = self.sourceDates[(self.sourceDates >= userStartDate) & (self.sourceDates <= userEndDate)]
+        monthDay = datesToAnalyse.month * 100 + datesToAnalyse.day
         
-        if monthStart > monthEnd:
-            datesToAnalyse = datesToAnalyse[(datesToAnalyse.month >= monthStart) | (datesToAnalyse.month <= monthEnd)]
+        if wrapFlag:
+            datesToAnalyse = datesToAnalyse[(monthDay >= seasonStart) | (monthDay <= seasonEnd)]
         else:
-            datesToAnalyse = datesToAnalyse[(datesToAnalyse.month >= monthStart) & (datesToAnalyse.month <= monthEnd)]
+            datesToAnalyse = datesToAnalyse[(monthDay >= seasonStart) & (monthDay <= seasonEnd)]
 
         self.datesToAnalyse = datesToAnalyse
         
-    
-        stepVec = np.array([])
-
-        period = np.arange(self.userDateVec.year.unique().min(), self.userDateVec.year.unique().max(),yearRange+1)
-
-        for i in period:
-            
-            startDate = pd.to_datetime(date(i, monthStart,1))
-            
-            if monthStart > monthEnd:
-                endDate = pd.to_datetime(date(i+yearRange+1, monthEnd,calendar.monthrange(i+yearRange+1, monthEnd)[1]))
-            else:
-                endDate = pd.to_datetime(date(i+yearRange, monthEnd,calendar.monthrange(i+yearRange, monthEnd)[1]))
-            
-            if endDate <= self.srcEndDate and endDate <= self.userDateVec[-1]: 
-                stepVec = np.append(stepVec, [{     "startDate": startDate, 
-                                                    "endDate": endDate,
-                                                    "startIdx": self.sourceDatesIdxAll[np.where(self.sourceDates==startDate)[0]],
-                                                    "endIdx": self.sourceDatesIdxAll[np.where(self.sourceDates==endDate)[0]],
-                                             }])
+        years = np.arange(self.userDateVec.year.min(), self.userDateVec.year.max(), yearRange+1)
+        
+        startDates = self.__createDates(years, monthStart, dayStart)
+        endDates = self.__createDates(years + yearRange + int(wrapFlag), monthEnd, dayEnd)
+        
+        startPos = self.sourceDates.get_indexer(startDates)
+        endPos = self.sourceDates.get_indexer(endDates)
+        
+        valid = (endDates <= self.srcEndDate) & (endDates <= self.userDateVec[-1]) & (startPos >= 0) & (endPos >= 0)
+        
+        stepVec = np.array([{   "startDate": startDate, 
+                                "endDate": endDate,
+                                "startIdx": self.sourceDatesIdxAll[sp:sp+1],
+                                "endIdx": self.sourceDatesIdxAll[ep:ep+1],
+                            } for startDate, endDate, sp, ep in zip(startDates[valid], endDates[valid], startPos[valid], endPos[valid])])
 
         self.boolDateVec = self.__createBoolDateVec()
         self.spanStartSpanEnd = stepVec
 
         return stepVec
+        
+        
+    def getPeriodRange(self, period):
+        '''
+        Returns the day indexes of a period for slicing. The
+        end date of a period is included.
+        
+        Parameters
+        ----------
+        period : dict
+            The period with start and end date
+            
+        Returns
+        ----------
+        range : tuple
+            (startIdx, endIdx) with endIdx after the end date
+        '''
+        return int(self.sourceDatesIdx[period["startDate"]]), int(self.sourceDatesIdx[period["endDate"]]) + 1
+        
+        
+    def __createDates(self, years, month, day):
+        '''
+        Creates the dates for the given years at the same
+        month and day. Days which do not exist in a month
+        (E.g. February 29th) are clipped to the last day of
+        the month. No day means the last day of the month.
+        
+        Parameters
+        ----------
+        years : ndarray
+            The years
+        month : int
+            Numeric month
+        day : int
+            Day of the month or None
+            
+        Returns
+        ----------
+        dates : pandas.DatetimeIndex
+        '''
+        years = np.asarray(years, dtype=int)
+        
+        if not len(years):
+            return pd.DatetimeIndex([])
+            
+        firstDays = pd.to_datetime(pd.DataFrame({"year": years, "month": month, "day": 1}))
+        daysInMonth = np.asarray(pd.DatetimeIndex(firstDays).days_in_month)
+        
+        if day is None:
+            days = daysInMonth
+        else:
+            days = np.minimum(day, daysInMonth)
+            
+        dates = pd.DatetimeIndex(firstDays) + pd.to_timedelta(days - 1, unit="D")
+        
+        return dates
        
 
     def createTimeBounds(self, dateRange):
@@ -195,10 +341,10 @@ class NcManager(object):
             Array with start and end index as days since (days since 
             is defined in the source ncfile).
         '''          
-        timebnd = np.empty((0,2))
+        if not len(dateRange):
+            return np.empty((0,2))
         
-        for i, item in enumerate(dateRange):
-            timebnd = np.append(timebnd, [[item["startIdx"][0],item["endIdx"][0]]], axis=0)
+        timebnd = np.array([[item["startIdx"][0], item["endIdx"][0]] for item in dateRange])
 
         return timebnd
 
@@ -213,39 +359,94 @@ class NcManager(object):
         outputPath : string
             The output path of the file
         '''  
+        if self.chunkStoreFlag:
+            self.__checkChunkAlignment()
+            
+        dateRange = self.createDateRanges(self.period)
+        timeBounds = self.createTimeBounds(dateRange)
+        varNameContainer = [i["var"] for i  in varsToBeAnalysed]
+        appendFlag = False
+        
+        if self.incrementalFlag:
+            self.pendingTimeBounds = timeBounds
+            
+            if os.path.exists(outputPath):
+                self.dst = self.__openOutput(outputPath, 'a')
+                self.stepOffset = self.__countExistingSteps(timeBounds)
+                dateRange = dateRange[self.stepOffset:]
+                self.spanStartSpanEnd = dateRange
+                self.pendingTimeBounds = timeBounds[self.stepOffset:]
+                appendFlag = True
+                print(str(self.stepOffset) + " periods already in output file. " + str(len(dateRange)) + " new periods to calculate.")
+        
+        if self.checkpointFlag:
+            signature = {   "periods": [(str(i["startDate"]), str(i["endDate"])) for i in dateRange],
+                            "vars": [self.createOutputVarName(i["var"], i["func"]) for i in varsToBeAnalysed if i["var"] != "skip"]
+                        }
+            
+            if self.loadCheckpoint(outputPath, signature):
+                if not appendFlag:
+                    self.dst = self.__openOutput(outputPath, 'a')
+                print("Resuming from checkpoint. " + str(len(self.checkpoint["completed"])) + " units already completed.")
+                return
+            
+        # The tiles write into a chunk store which was created before (see enableChunkStore())
+        if self.chunkStoreFlag and self.tileFlag:
+            self.dst = self.__openChunkStoreTile(outputPath, varsToBeAnalysed, len(timeBounds))
+            appendFlag = True
+            
+        if appendFlag:
+            if self.checkpointFlag:
+                self.checkpoint = {"signature": signature, "completed": set(), "csv": {}}
+                self.saveCheckpoint()
+            return
+            
         try:
-            self.dst = Dataset(outputPath, 'w', format="NETCDF4")
+            self.dst = self.__openOutput(outputPath, 'w')
         except IOError as (errno, strerror):
             print "Could not open netCDF file. NO OUTPUT CREATED. I/O error({0}): {1}".format(errno, strerror)
         except:
             print "Could not open netCDF file. Unexpected error:", sys.exc_info()[0]
             raise
         
-        # Create dimensions
+        # Create dimensions. The time dimension is unlimited, so that new periods can be appended.
+        # A chunk store always covers the whole grid, the tiles write into their window.
         for name, dimension in self.src.dimensions.iteritems():
-            self.dst.createDimension(name, len(dimension) if not dimension.isunlimited() else None)
+            if self.chunkStoreFlag and (dimension.isunlimited() or name == "time"):
+                self.dst.createDimension(name, len(timeBounds), unlimited=True)
+            elif name in self.__windowSlices() and not self.chunkStoreFlag:
+                self.dst.createDimension(name, len(range(*self.__windowSlices()[name].indices(len(dimension)))))
+            else:
+                self.dst.createDimension(name, len(dimension) if not (dimension.isunlimited() or name == "time") else None)
+                
+        # Only the outputs of tiles can be merged, subsets are marked separately
+        if self.window is not None and not self.chunkStoreFlag and self.tileFlag:
+            self.dst.setncattr("tile_window", list(self.window))
+            self.dst.setncattr("grid_shape", list(self.__gridShape()))
+        elif self.window is not None and not self.chunkStoreFlag:
+            self.dst.setncattr("subset_window", list(self.window))
+            
+        if self.stride != (1, 1):
+            self.dst.setncattr("grid_stride", list(self.stride))
             
 
         # Add variables
         daysSince = str(self.daysSince).split()[0] 
         tunits = "days since " + daysSince
-       
-        dateRange = self.createDateRanges(self.period)
-        timeBounds = self.createTimeBounds(dateRange)
             
         time = self.dst.createVariable(varname = 'time', datatype = 'i', dimensions = ('time'))  
         time.units = tunits
         time.bounds = "time_bnds"
-        time[:] = timeBounds[:,1]
         
-        bndsDim = self.dst.createDimension("bnds")
+        bndsDim = self.dst.createDimension("bnds", 2 if self.chunkStoreFlag else None)
         time_bnds = self.dst.createVariable(varname = 'time_bnds', datatype = 'i', dimensions = ('time', 'bnds'))
         time_bnds.calendar = "gregorian";
         time_bnds.units = tunits
         
-        time_bnds[:] = timeBounds
-        
-        varNameContainer = [i["var"] for i  in varsToBeAnalysed]
+        # In incremental mode the time bounds are written when the output file is closed
+        if not self.incrementalFlag:
+            time[:] = timeBounds[:,1]
+            time_bnds[:] = timeBounds
   
         for name, variable in self.src.variables.iteritems():
         
@@ -255,24 +456,481 @@ class NcManager(object):
             if name not in varNameContainer and name != xDim and name != yDim: 
                 continue
             
+            func = None
+            
             for var in varsToBeAnalysed:
                 if name == var["var"]:
-                    funcName = var["func"]["name"]
-                    funcProps = var["func"]["props"] 
-                    if funcProps:
-                        name = name + "_[" + funcName + "_" + funcProps[1] + "_" + str(funcProps[2]) + "]"
-                    else:
-                        name = name + "_[" + funcName + "]"
+                    func = var["func"]
+                    name = self.createOutputVarName(name, func)
 
-            varOut = self.dst.createVariable(name, variable.datatype, variable.dimensions)
+            self.__createOutputVariable(name, variable, variable.dimensions, variable.datatype, func)
             
             if name == xDim or name == yDim:
-                self.dst.variables[name][:] = self.src.variables[name][:]  
+                self.dst.variables[name][:] = self.src.variables[name][slice(None) if self.chunkStoreFlag else self.__windowSlices()[name]]  
+            
+        if self.checkpointFlag:
+            self.checkpoint = {"signature": signature, "completed": set(), "csv": {}}
+            self.saveCheckpoint()
+            
+            
+    def __openOutput(self, outputPath, mode):
+        '''
+        Opens the output file or the chunk store.
+        '''
+        if self.chunkStoreFlag:
+            return ChunkStore(outputPath, mode, self.chunkStoreChunks)
+            
+        return Dataset(outputPath, mode, format="NETCDF4")
+        
+        
+    def __openChunkStoreTile(self, outputPath, varsToBeAnalysed, steps):
+        '''
+        Opens the existing chunk store for writing a tile and
+        checks that it contains the output variables.
+        '''
+        if not os.path.exists(os.path.join(outputPath, ".zgroup")):
+            raise ValueError("The chunk store '" + outputPath + "' does not exist. It has to be created before the tiles are written (see enableChunkStore()).")
+            
+        store = ChunkStore(outputPath, "a")
+        
+        if store.dimensions.get("time") != steps:
+            raise ValueError("The chunk store '" + outputPath + "' has " + str(store.dimensions.get("time")) + " periods instead of " + str(steps) + ".")
+            
+        for var in varsToBeAnalysed:
+            if var["var"] != "skip" and self.createOutputVarName(var["var"], var["func"]) not in store.variables:
+                raise ValueError("Variable '" + self.createOutputVarName(var["var"], var["func"]) + "' is missing in the chunk store '" + outputPath + "'.")
+                
+        return store
+        
+        
+    def enableChunkStore(self, chunks=None):
+        '''
+        Enables the chunked directory store as output backend
+        (see chunk_store.ChunkStore). The output path is then a
+        directory. Every chunk is written as a file of its own,
+        so the processes of a sharded run (see setTile()) can
+        write into the same store concurrently. The tiles have
+        to be aligned to the chunks (see TileManager.createTiles()).
+        The store (with all its metadata) is created once by 
+        initializing the output without a tile (E.g. 
+        StatsUnivariat.setVariablesToAnalyse()) before the tiles
+        are started. The tiles only open it and write chunks.
+        The store can be converted to netCDF afterwards with 
+        ChunkStore(path).toNetCDF(ncPath). Has to be called 
+        before the output file is initialized. Not available 
+        in incremental mode.
+        
+        Parameters
+        ----------
+        chunks : tuple
+            The spatial chunk size (cy, cx). Defaults to the
+            whole grid (one chunk per period). Required for tiles.
+        '''
+        if self.incrementalFlag:
+            raise ValueError("The chunk store is not available in incremental mode.")
+            
+        self.chunkStoreFlag = True
+        self.chunkStoreChunks = None if chunks is None else tuple(int(c) for c in chunks)
+        
+        
+    def __checkChunkAlignment(self):
+        '''
+        Checks that the tile is aligned to the chunks of
+        the store, so no chunk is shared between writers.
+        '''
+        if self.stride != (1, 1):
+            raise ValueError("A stride is not available with the chunk store.")
+            
+        if self.window is None:
+            if self.chunkStoreChunks is None:
+                self.chunkStoreChunks = self.__gridShape()
+            return
+            
+        if self.chunkStoreChunks is None:
+            raise ValueError("The chunk size has to be set when writing tiles into a chunk store.")
             
-            # Set variable attributes  
-            varOut.setncatts({k: variable.getncattr(k) for k in variable.ncattrs()})        
+        ny, nx = self.__gridShape()
+        y0, y1, x0, x1 = self.window
+        cy, cx = self.chunkStoreChunks
+        
+        if y0 % cy or x0 % cx or (y1 % cy and y1 != ny) or (x1 % cx and x1 != nx):
+            raise ValueError("Tile " + str(self.window) + " is not aligned to the chunks " + str(self.chunkStoreChunks) + ". Concurrent writers would share chunks.")
+        
+        
+    def enableIncremental(self):
+        '''
+        Enables the incremental mode. If the output file 
+        already exists, its time bounds are compared with
+        the periods of the (grown) source file and only the 
+        new periods are calculated and appended along the 
+        unlimited time dimension. Has to be called before
+        the timespan is set.
+        '''
+        self.incrementalFlag = True
+        
+        
+    def __countExistingSteps(self, timeBounds):
+        '''
+        Counts the periods which are already complete in 
+        the existing output file and checks that they match
+        the periods of the current run.
+        
+        Parameters
+        ----------
+        timeBounds : ndarray
+            The time bounds of all periods of the current run
             
+        Returns
+        ----------
+        n : int
+            The number of existing periods
+        '''
+        bnds = self.dst.variables["time_bnds"][:]
+        valid = ~ma.getmaskarray(bnds).any(axis=1)
+        n = int(valid.sum())
+        
+        if not valid[:n].all() or n > len(timeBounds) or not np.array_equal(np.asarray(bnds[:n]), timeBounds[:n]):
+            raise ValueError("The time bounds of the existing output file do not match the periods of the source file. Incremental mode not possible.")
             
+        return n
+        
+        
+    def closeOutputFile(self):
+        '''
+        Writes the pending time bounds (incremental mode)
+        and closes the output file.
+        '''
+        bnds = self.pendingTimeBounds
+        
+        if len(bnds):
+            steps = slice(self.stepOffset, self.stepOffset + len(bnds))
+            self.dst.variables["time"][steps] = bnds[:,1]
+            self.dst.variables["time_bnds"][steps,:] = bnds
+            self.pendingTimeBounds = np.empty((0,2))
+            
+        self.dst.close()
+        
+        
+    def enableCheckpoint(self, checkpointPath=None):
+        '''
+        Enables checkpointing. Every completed (variable, step)
+        unit is recorded in a sidecar file, so that an aborted
+        run can be resumed. On restart the output file is 
+        reopened in append mode and only the missing units 
+        are calculated. Has to be called before the output
+        file is initialized.
+        
+        Parameters
+        ----------
+        checkpointPath : string
+            Path of the sidecar file. Defaults to the output 
+            path with the suffix ".ckpt"
+        '''
+        self.checkpointFlag = True
+        self.checkpointPath = checkpointPath
+        
+        
+    def loadCheckpoint(self, outputPath, signature):
+        '''
+        Loads the checkpoint of a previous run if there
+        is one for the output file.
+        
+        Parameters
+        ----------
+        outputPath : string
+            The output path of the file
+        signature : dict
+            The periods and variables of the current run
+            
+        Returns
+        ----------
+        resume : bool
+            True if the run can be resumed
+        '''
+        if self.checkpointPath is None:
+            self.checkpointPath = outputPath + ".ckpt"
+            
+        if not (os.path.exists(self.checkpointPath) and os.path.exists(outputPath)):
+            return False
+            
+        with open(self.checkpointPath, "rb") as f:
+            checkpoint = pickle.load(f)
+            
+        if checkpoint["signature"] != signature:
+            raise ValueError("Checkpoint '" + self.checkpointPath + "' belongs to a run with other periods or variables. Remove it to start from scratch.")
+            
+        self.checkpoint = checkpoint
+        
+        return True
+        
+        
+    def saveCheckpoint(self):
+        '''
+        Writes the checkpoint to the sidecar file. The file
+        is written to a temporary file first and renamed 
+        afterwards, so an abort never leaves a broken 
+        checkpoint behind.
+        '''
+        tmpPath = self.checkpointPath + ".tmp"
+        
+        with open(tmpPath, "wb") as f:
+            pickle.dump(self.checkpoint, f, pickle.HIGHEST_PROTOCOL)
+            
+        try:
+            os.rename(tmpPath, self.checkpointPath)
+        except OSError:
+            os.remove(self.checkpointPath)
+            os.rename(tmpPath, self.checkpointPath)
+            
+            
+    def isCompleted(self, varName, stepIncr):
+        '''
+        Checks if a (variable, step) unit was already 
+        completed in a previous run.
+        '''
+        if self.checkpoint is None:
+            return False
+            
+        return (varName, stepIncr) in self.checkpoint["completed"]
+        
+        
+    def markCompleted(self, varName, stepIncr, csv):
+        '''
+        Records a completed (variable, step) unit. The output
+        file is flushed to disk and the csv partials are 
+        stored along with the checkpoint.
+        
+        Parameters
+        ----------
+        varName : string
+            The output variable name
+        stepIncr : int
+            The completed calculation step
+        csv : csv_manager.CsvManager
+            Manages the csv output
+        '''
+        if self.checkpoint is None:
+            return
+            
+        with self.ioLock:
+            self.dst.sync()
+            
+        self.checkpoint["completed"].add((varName, stepIncr))
+        self.checkpoint["csv"] = csv.getPartials()
+        self.saveCheckpoint()
+        
+        
+    def removeCheckpoint(self):
+        '''
+        Removes the checkpoint after a successful run.
+        '''
+        if self.checkpoint is not None and os.path.exists(self.checkpointPath):
+            os.remove(self.checkpointPath)
+            
+        self.checkpoint = None
+            
+            
+    def createOutputVarName(self, varName, func):
+        '''
+        Creates the name of the output variable from the
+        source variable name and the applied function
+        (E.g. "asmh_[mean]" or "sweosasm_[count_>_90]").
+        
+        Parameters
+        ----------
+        varName : string
+            The source variable name
+        func : dict
+            Dict with the function name and properties
+            
+        Returns
+        ----------
+        name : string
+            The output variable name
+        '''
+        funcName = func["name"]
+        funcProps = func["props"]
+        
+        if funcProps:
+            name = varName + "_[" + funcName + "_" + funcProps[1] + "_" + str(funcProps[2]) + "]"
+        else:
+            name = varName + "_[" + funcName + "]"
+            
+        return name
+        
+        
+    def addOutputDimension(self, name, size):
+        '''
+        Adds a dimension to the output file if it
+        does not exist yet.
+        
+        Parameters
+        ----------
+        name : string
+            The dimension name
+        size : int
+            The dimension length (None for unlimited)
+        '''
+        if name not in self.dst.dimensions:
+            self.__checkNotChunkStoreTile(name)
+            self.dst.createDimension(name, size)
+            
+            
+    def __checkNotChunkStoreTile(self, name):
+        '''
+        The metadata of a chunk store is only written when it
+        is created, not by the tiles.
+        '''
+        if self.chunkStoreFlag and self.tileFlag:
+            raise ValueError("'" + name + "' is missing in the chunk store. It has to be created before the tiles are written.")
+            
+            
+    def addOutputVariable(self, name, templateName, dimensions=None, datatype=None, attrs=None, derived=False):
+        '''
+        Adds a variable to the output file which takes
+        its datatype and attributes from a source variable.
+        
+        Parameters
+        ----------
+        name : string
+            The output variable name
+        templateName : string
+            The name of the source variable to copy 
+            the metadata from
+        dimensions : tuple
+            The dimensions of the output variable. Defaults
+            to the dimensions of the source variable.
+        datatype : string
+            The datatype of the output variable. Defaults 
+            to the datatype of the source variable.
+        attrs : dict
+            Attributes which replace the ones of the source
+            variable (E.g. units)
+        derived : bool
+            If True, the variable is a derived quantity (E.g.
+            a correlation) and the attributes which describe
+            the source values (standard_name, valid range,
+            packing) are not copied
+        '''
+        if name in self.dst.variables:
+            return
+            
+        self.__checkNotChunkStoreTile(name)
+        template = self.src.variables[templateName]
+        
+        if dimensions is None:
+            dimensions = template.dimensions
+        if datatype is None:
+            datatype = template.datatype
+            
+        self.__createOutputVariable(name, template, dimensions, datatype, derived=derived)
+        
+        if attrs:
+            self.dst.variables[name].setncatts(attrs)
+            
+            
+    def __createOutputVariable(self, name, template, dimensions, datatype, func=None, derived=False):
+        '''
+        Creates an output variable with the attributes of
+        a source variable. The fill value is set on creation.
+        If the datatype differs from the source, the packing
+        attributes are dropped. In packed I/O mode counts are
+        written as plain integers and packed variables are
+        written unpacked as float unless packOutputFlag is set.
+        Only results with the range of the daily values (mean)
+        are written packed, sums would overflow the packing.
+        
+        Parameters
+        ----------
+        name : string
+            The output variable name
+        template : netCDF4._netCDF4.Variable
+            The source variable to copy the metadata from
+        dimensions : tuple
+            The dimensions of the output variable
+        datatype : string
+            The datatype of the output variable
+        func : dict
+            The function applied to the variable (if any)
+        derived : bool
+            Drop the attributes which only describe the source 
+            values (see addOutputVariable())
+        '''
+        attrs = {k: template.getncattr(k) for k in template.ncattrs()}
+        fill = attrs.pop("_FillValue", None)
+        packed = "scale_factor" in attrs or "add_offset" in attrs
+        
+        if self.packedIOFlag and func is not None and func["name"] == "count":
+            datatype = "i4"
+        elif self.packedIOFlag and packed and not self.packOutputFlag:
+            datatype = "f4"
+        elif self.packedIOFlag and packed and func is not None and func["name"] != "mean":
+            datatype = "f4"
+            
+        if np.dtype(datatype) != template.dtype or derived:
+            for k in ("scale_factor", "add_offset", "missing_value", "valid_min", "valid_max", "valid_range"):
+                attrs.pop(k, None)
+                
+        if derived:
+            attrs.pop("standard_name", None)
+            
+        if np.dtype(datatype) != template.dtype:
+            fill = None
+        
+        varOut = self.dst.createVariable(name, datatype, dimensions, fill_value=fill)
+        varOut.setncatts(attrs)
+        
+        
+    def enablePackedIO(self, packOutput=False):
+        '''
+        Enables the packed-integer and fill-value-aware 
+        I/O path. Daily variables are then read raw (not 
+        unpacked to float) and reduced on the raw scale with
+        compact boolean masks for the fill values. Has to be
+        called before the output file is initialized.
+        
+        Parameters
+        ----------
+        packOutput : bool
+            If True, means of packed variables are written 
+            packed with the scale_factor and add_offset of the
+            source. Otherwise and for sums (which exceed the
+            range of the packing) they are written as float.
+        '''
+        self.packedIOFlag = True
+        self.packOutputFlag = packOutput
+        
+        
+    def getPacking(self, variable):
+        '''
+        Returns the packing parameters of a variable.
+        
+        Parameters
+        ----------
+        variable : netCDF4._netCDF4.Variable
+            Raw nc variable
+            
+        Returns
+        ----------
+        packing : tuple
+            (scale_factor, add_offset, fill value). The fill
+            value is the netCDF default if not set and None
+            if the variable has no fill value.
+        '''
+        attrs = variable.ncattrs()
+        scale = variable.getncattr("scale_factor") if "scale_factor" in attrs else 1.0
+        offset = variable.getncattr("add_offset") if "add_offset" in attrs else 0.0
+        
+        if "_FillValue" in attrs:
+            fill = variable.getncattr("_FillValue")
+        elif "missing_value" in attrs:
+            fill = variable.getncattr("missing_value")
+        else:
+            fill = default_fillvals.get(variable.dtype.str[1:])
+            
+        return (scale, offset, fill)
+        
+        
     def writeToOutputFile(self, varName, stepIncr, data):
         '''
         Write the data iteratively to the file
@@ -281,12 +939,90 @@ class NcManager(object):
         ----------
         varName : string
             The variable name
-        stepIncr : int
-            The current calculation step (Starting at 0)
+        stepIncr : int or slice
+            The current calculation step (Starting at 0). In 
+            incremental mode the existing steps are skipped.
         data : ndarray
             The data to write
         '''
-        self.dst.variables[varName][stepIncr,:,:] = data
+        if self.dst.variables[varName].dtype.kind in "iu" and np.asarray(data).dtype.kind == "f":
+            invalid = np.isnan(data)
+            data = ma.array(np.where(invalid, 0, data), mask=invalid)
+            
+        if isinstance(stepIncr, slice):
+            stop = None if stepIncr.stop is None else stepIncr.stop + self.stepOffset
+            stepIncr = slice((stepIncr.start or 0) + self.stepOffset, stop)
+        else:
+            stepIncr = stepIncr + self.stepOffset
+            
+        with self.ioLock:
+            self.dst.variables[varName][self.__outputIndex(varName, stepIncr)] = data
+        
+        
+    def writeOutputVariable(self, varName, data):
+        '''
+        Writes a whole output variable at once (E.g. 
+        variables without time dimension).
+        
+        Parameters
+        ----------
+        varName : string
+            The variable name
+        data : ndarray
+            The data to write
+        '''
+        with self.ioLock:
+            self.dst.variables[varName][self.__outputIndex(varName)] = data
+            
+            
+    def __outputWindow(self):
+        '''
+        Returns the slices of the analysed window within the
+        output. The netCDF output only covers the window, the
+        chunk store covers the whole grid.
+        '''
+        if self.chunkStoreFlag:
+            return self.__windowSlices()
+            
+        return {"y": slice(None), "x": slice(None)}
+        
+        
+    def __outputIndex(self, varName, stepIncr=None):
+        '''
+        Creates the index of the analysed window (and step)
+        within an output variable.
+        '''
+        window = self.__outputWindow()
+        idx = tuple(window.get(dim, slice(None)) for dim in self.dst.variables[varName].dimensions)
+        
+        if stepIncr is not None:
+            idx = (stepIncr,) + idx[1:]
+            
+        return idx
+        
+        
+    def createDayOfYearGroups(self, dates):
+        '''
+        Maps dates to day-of-year groups (0 to 365). In
+        non leap years the days after February are shifted
+        by one, so that e.g. March 1st always falls into
+        the same group and February 29th gets its own group.
+        
+        Parameters
+        ----------
+        dates : pandas.DatetimeIndex
+            The dates to map
+            
+        Returns
+        ----------
+        groups : ndarray
+            The day-of-year group of each date
+        '''
+        doy = np.asarray(dates.dayofyear) - 1
+        shift = ~np.asarray(dates.is_leap_year) & (np.asarray(dates.month) > 2)
+        groups = doy + shift.astype(int)
+        
+        return groups
         
         
     def __setDaysSince(self, dateTimeString):
@@ -302,12 +1038,38 @@ class NcManager(object):
         ----------
         dateTime : datetime
         '''         
-        dts = dateTimeString.units.split()[2:][0]
+        dts = " ".join(dateTimeString.units.split()[2:4])
         dateTime =  pd.to_datetime(dts) 
         
         return dateTime
         
         
+    def __setTimeUnit(self, dateTimeString):
+        '''
+        The unit of the time axis (E.g. "hours" of 
+        "hours since 1949-12-01 00:00:00")
+        
+        Parameters
+        ----------
+        dateTimeString : string
+            The raw datetime string of the ncfile
+            
+        Returns
+        ----------
+        unit : string
+            The unit as pandas timedelta unit
+        '''
+        units = {"days": "D", "day": "D", "hours": "h", "hour": "h", 
+                 "minutes": "m", "minute": "m", "seconds": "s", "second": "s"}
+        
+        name = dateTimeString.units.split()[0].lower()
+        
+        if name not in units:
+            raise ValueError("Time unit '" + name + "' not supported.")
+        
+        return units[name]
+        
+        
     def __setSourceDates(self, daysSince):
         '''
         Creates dates of the source file dates
@@ -315,21 +1077,462 @@ class NcManager(object):
         Parameters
         ----------
         daysSince : ndarray
-            The days since the dataset start 
+            The time values since the dataset start 
             
         Returns
         ----------
         dateTimeVec : ndarray
             The dates as datetime
         '''        
-        vfunc = np.vectorize(pd.to_timedelta)
-        
-        dateTimeVec = vfunc(daysSince, "D") 
+        dateTimeVec = pd.to_timedelta(np.asarray(daysSince, dtype=np.float64), unit=self.timeUnit) 
         
         dateTimeVec = self.daysSince +  dateTimeVec
         dateTimeVec = pd.to_datetime(dateTimeVec)
         
         return dateTimeVec
+        
+        
+    def __setDailyDates(self, stepDates):
+        '''
+        Creates the daily dates of the source file and
+        the index of the first time step of each day.
+        
+        Parameters
+        ----------
+        stepDates : ndarray
+            The datetimes of all time steps
+            
+        Returns
+        ----------
+        dailyDates : pandas.DatetimeIndex
+            The days as datetime (00:00)
+        dayStartSteps : ndarray
+            The first step index of each day and the number
+            of steps as last element
+        '''
+        days = stepDates.normalize()
+        dailyDates = days.unique()
+        dayStartSteps = np.append(np.searchsorted(np.asarray(days), np.asarray(dailyDates)), len(days))
+        
+        return dailyDates, dayStartSteps
+
+
+    def setResampleMethod(self, varName, how):
+        '''
+        Sets the method with which sub-daily time steps
+        of a variable are aggregated to daily values.
+        
+        Parameters
+        ----------
+        varName : string
+            The variable name
+        how : string
+            "mean", "sum", "min" or "max"
+        '''
+        if how not in ("mean", "sum", "min", "max"):
+            raise ValueError("Resample method '" + str(how) + "' not known. Available methods are (mean, sum, min, max)")
+            
+        self.resampleMethods[varName] = how
+        
+        
+    def readSlab(self, variable, startIdx, endIdx, raw=False, rows=None):
+        '''
+        Reads the daily data of a variable between two
+        day indexes. Sub-daily data is read blockwise and
+        resampled to daily values on the fly, so the
+        sub-daily steps of the whole range are never held
+        in memory at once. In active-cell mode only the 
+        bounding box of the active cells is read and the 
+        active cells are gathered into a (days, cells) array.
+        
+        Parameters
+        ----------
+        variable : netCDF4._netCDF4.Variable
+            Raw nc variable
+        startIdx : int
+            Index of the first day
+        endIdx : int
+            Index after the last day
+        raw : bool
+            If True, packed data is returned on the raw
+            (packed) scale. Only for daily data.
+        rows : tuple
+            Only read a band of rows (r0, r1) of the window.
+            Not available in active-cell mode.
+            
+        Returns
+        ----------
+        data : ndarray
+            The daily data (days, y, x) or (days, cells) in 
+            active-cell mode
+        '''
+        with self.ioLock:
+            if rows is not None:
+                if self.activeCellsFlag:
+                    raise ValueError("Row bands are not available in active-cell mode.")
+                    
+                return self.__readCached(variable, startIdx, endIdx, raw, (rows[0], rows[1], 0, self.getWindowShape()[1]))
+                
+            if not self.activeCellsFlag:
+                return self.__readCached(variable, startIdx, endIdx, raw)
+                
+            if self.activeCells is None:
+                data = self.__readCached(variable, startIdx, endIdx, raw)
+                self.__detectActiveCells(variable, data, raw)
+                y0, y1, x0, x1 = self.activeBox
+                data = data[:, y0:y1, x0:x1]
+            else:
+                data = self.__readCached(variable, startIdx, endIdx, raw, self.activeBox)
+                
+            data = data.reshape((data.shape[0], -1))[:, self.activeCells]
+            
+            return data
+        
+        
+    def enableSlabCache(self, budgetBytes=512 * 1024**2, cache=None):
+        '''
+        Enables the slab cache. Repeated or overlapping reads
+        of a variable (several functions, overlapping seasons)
+        are then served from memory as far as possible and only
+        the missing days are read from disk.
+        
+        Parameters
+        ----------
+        budgetBytes : int
+            The maximum size of the cache in bytes
+        cache : slab_cache.SlabCache
+            An existing cache to be shared with other 
+            NcManager instances (budgetBytes is then ignored)
+        '''
+        self.slabCache = cache if cache is not None else SlabCache(budgetBytes)
+        
+        
+    def __readCached(self, variable, startIdx, endIdx, raw, box=None):
+        '''
+        Reads the daily data of a variable between two day
+        indexes through the slab cache (if enabled). The key
+        contains everything besides the time range that 
+        changes the slab: file, variable, scale, resample 
+        method and spatial window.
+        '''
+        if self.slabCache is None:
+            return self.__readRange(variable, startIdx, endIdx, raw, box)
+            
+        ys, xs = self.__windowSlices()["y"], self.__windowSlices()["x"]
+        key = (variable.group().filepath(), variable.name, bool(raw), self.resampleMethods.get(variable.name, "mean"),
+               ys.start, ys.stop, ys.step, xs.start, xs.stop, xs.step, box)
+        
+        return self.slabCache.get(key, startIdx, endIdx, lambda s, e: self.__readRange(variable, s, e, raw, box))
+        
+        
+    def __readRange(self, variable, startIdx, endIdx, raw, box=None):
+        '''
+        Reads the daily data of a variable between two day
+        indexes within the tile window, optionally only 
+        within a box (y0, y1, x0, x1) relative to the window.
+        The box is given in cells of the (strided) window. 
+        Strides are passed to the netCDF library, so only 
+        the requested hyperslab is read from disk.
+        '''
+        ys, xs = self.__windowSlices()["y"], self.__windowSlices()["x"]
+        
+        if box is not None:
+            ys = slice(ys.start + box[0] * ys.step, ys.start + box[1] * ys.step, ys.step)
+            xs = slice(xs.start + box[2] * xs.step, xs.start + box[3] * xs.step, xs.step)
+            
+        if raw:
+            variable.set_auto_scale(False)
+            try:
+                return variable[startIdx:endIdx, ys, xs]
+            finally:
+                variable.set_auto_scale(True)
+                
+        if not self.subDailyFlag:
+            return variable[startIdx:endIdx, ys, xs]
+            
+        how = self.resampleMethods.get(variable.name, "mean")
+        steps = self.dayStartSteps
+        data = None
+        
+        for blockStart in range(startIdx, endIdx, self.resampleChunkDays):
+            blockEnd = min(blockStart + self.resampleChunkDays, endIdx)
+            
+            block = np.asarray(variable[steps[blockStart]:steps[blockEnd], ys, xs], dtype=np.float64)
+            offsets = steps[blockStart:blockEnd] - steps[blockStart]
+            
+            if how == "min":
+                daily = np.minimum.reduceat(block, offsets, axis=0)
+            elif how == "max":
+                daily = np.maximum.reduceat(block, offsets, axis=0)
+            else:
+                daily = np.add.reduceat(block, offsets, axis=0)
+                
+                if how == "mean":
+                    nSteps = np.diff(steps[blockStart:blockEnd+1])
+                    daily /= nSteps.reshape((-1,) + (1,) * (block.ndim - 1))
+                    
+            if data is None:
+                data = np.empty((endIdx - startIdx,) + daily.shape[1:])
+                
+            data[blockStart-startIdx:blockEnd-startIdx] = daily
+            
+        return data
+        
+        
+    def setTile(self, yStart, yEnd, xStart, xEnd):
+        '''
+        Restricts the analysis to a spatial tile of the
+        grid (shard mode). Only the tile is read, and the
+        output file only covers the tile. The tiles of
+        several independent runs can be assembled with
+        tile_manager.TileManager().mergeTiles(). Has to be
+        called before the output file is initialized.
+        
+        Parameters
+        ----------
+        yStart, yEnd : int
+            Index range of the tile in y direction (end excluded)
+        xStart, xEnd : int
+            Index range of the tile in x direction (end excluded)
+        '''
+        self.setIndexWindow(yStart, yEnd, xStart, xEnd)
+        self.tileFlag = True
+        
+        
+    def setIndexWindow(self, yStart, yEnd, xStart, xEnd):
+        '''
+        Restricts the analysis to an index window of the 
+        grid (E.g. for regional studies). Only the window is
+        read from disk and the output dimensions and the x/y
+        coordinates only cover the window. Has to be called 
+        before the output file is initialized.
+        
+        Parameters
+        ----------
+        yStart, yEnd : int
+            Index range of the window in y direction (end excluded)
+        xStart, xEnd : int
+            Index range of the window in x direction (end excluded)
+        '''
+        ny, nx = self.__gridShape()
+        
+        if not (0 <= yStart < yEnd <= ny and 0 <= xStart < xEnd <= nx):
+            raise ValueError("Window " + str((yStart, yEnd, xStart, xEnd)) + " is out of the grid bounds " + str((ny, nx)))
+            
+        self.window = (int(yStart), int(yEnd), int(xStart), int(xEnd))
+        self.tileFlag = False
+        
+        
+    def setBoundingBox(self, xMin, yMin, xMax, yMax):
+        '''
+        Restricts the analysis to the cells whose x/y 
+        coordinates lie inside a bounding box (bounds 
+        included). The box is converted to an index window
+        (see setIndexWindow()).
+        
+        Parameters
+        ----------
+        xMin, yMin, xMax, yMax : float
+            The bounding box in the units of the x and y 
+            coordinate variables
+        '''
+        idx = {}
+        
+        for name, lower, upper in (("y", yMin, yMax), ("x", xMin, xMax)):
+            coords = np.asarray(self.src.variables[name][:])
+            inside = np.flatnonzero((coords >= lower) & (coords <= upper))
+            
+            if not len(inside):
+                raise ValueError("Bounding box " + str((xMin, yMin, xMax, yMax)) + " contains no cells in " + name + " direction.")
+                
+            idx[name] = (inside[0], inside[-1] + 1)
+            
+        self.setIndexWindow(idx["y"][0], idx["y"][1], idx["x"][0], idx["x"][1])
+        
+        
+    def setStride(self, yStride, xStride):
+        '''
+        Only analyses every yStride-th row and xStride-th 
+        column of the window (E.g. 4, 4 for a coarsened 
+        preview). The stride is applied inside the netCDF 
+        reads and the output dimensions and coordinates are
+        sized accordingly. Has to be called before the output
+        file is initialized.
+        
+        Parameters
+        ----------
+        yStride, xStride : int
+            The stride in y and x direction
+        '''
+        if yStride < 1 or xStride < 1:
+            raise ValueError("Stride has to be >= 1")
+            
+        self.stride = (int(yStride), int(xStride))
+        
+        
+    def __gridShape(self):
+        return (len(self.src.dimensions["y"]), len(self.src.dimensions["x"]))
+        
+        
+    def __windowSlices(self):
+        '''
+        Returns the slices of the tile window for the
+        y and x dimension (the whole grid without tile),
+        with the stride as step.
+        '''
+        sy, sx = self.stride
+        
+        if self.window is None:
+            ny, nx = self.__gridShape()
+            return {"y": slice(0, ny, sy), "x": slice(0, nx, sx)}
+            
+        y0, y1, x0, x1 = self.window
+        
+        return {"y": slice(y0, y1, sy), "x": slice(x0, x1, sx)}
+        
+        
+    def getWindowShape(self):
+        '''
+        Returns the shape (ny, nx) of the analysed (strided)
+        window (the whole grid without tile).
+        '''
+        slices = self.__windowSlices()
+        
+        return (len(range(slices["y"].start, slices["y"].stop, slices["y"].step)), 
+                len(range(slices["x"].start, slices["x"].stop, slices["x"].step)))
+        
+        
+    def toLocalIndex(self, yIdx, xIdx):
+        '''
+        Converts grid indexes to indexes of the output 
+        frames (relative to the tile window and strided).
+        
+        Parameters
+        ----------
+        yIdx, xIdx : int
+            Indexes in the whole grid
+            
+        Returns
+        ----------
+        idx : tuple
+            (yIdx, xIdx) in the output frames or None if 
+            the point is not inside the tile or not on the
+            strided grid
+        '''
+        slices = self.__windowSlices()
+        ys, xs = slices["y"], slices["x"]
+        
+        if not (ys.start <= yIdx < ys.stop and xs.start <= xIdx < xs.stop):
+            return None
+            
+        if (yIdx - ys.start) % ys.step or (xIdx - xs.start) % xs.step:
+            return None
+            
+        return ((yIdx - ys.start) // ys.step, (xIdx - xs.start) // xs.step)
+        
+        
+    def enableActiveCells(self, maskVarName=None):
+        '''
+        Enables the active-cell mode. The valid cells are
+        determined once, either from a mask variable (cells
+        != 0) or from the first slab which is read (cells
+        which are not fill/nan on all days). Afterwards 
+        only the active cells are read and reduced and the
+        results are scattered back to the grid on writing.
+        
+        Parameters
+        ----------
+        maskVarName : string
+            Name of the mask variable in the source file
+        '''
+        self.activeCellsFlag = True
+        
+        if maskVarName is not None:
+            mask = self.src.variables[maskVarName]
+            values = np.asarray(mask[:])
+            
+            if values.ndim == 3:
+                values = values[0]
+                
+            values = values[self.__windowSlices()["y"], self.__windowSlices()["x"]]
+                
+            fill = self.getPacking(mask)[2]
+            active = (values != 0) & ~np.isnan(values.astype(np.float64))
+            
+            if fill is not None:
+                active &= values != fill
+                
+            self.__setActiveCells(active)
+            
+            
+    def __detectActiveCells(self, variable, data, raw):
+        '''
+        Detects the active cells from a slab. A cell is 
+        active if it has at least one valid value.
+        '''
+        scale, offset, fill = self.getPacking(variable)
+        valid = ~np.isnan(np.asarray(data, dtype=np.float64))
+        
+        if fill is not None:
+            if not raw:
+                fill = fill * scale + offset
+            valid &= data != fill
+            
+        self.__setActiveCells(valid.any(axis=0))
+        
+        
+    def __setActiveCells(self, active):
+        '''
+        Stores the bounding box of the active cells and 
+        their flat indexes within the box.
+        
+        Parameters
+        ----------
+        active : ndarray
+            Two dimensional boolean array of the active cells
+        '''
+        rows = np.flatnonzero(active.any(axis=1))
+        cols = np.flatnonzero(active.any(axis=0))
+        
+        if not len(rows):
+            raise ValueError("No active cells found.")
+            
+        self.gridShape = active.shape
+        self.activeBox = (rows[0], rows[-1] + 1, cols[0], cols[-1] + 1)
+        self.activeCells = np.flatnonzero(active[rows[0]:rows[-1]+1, cols[0]:cols[-1]+1])
+        
+        print("Active cells: " + str(len(self.activeCells)) + " of " + str(active.size))
+        
+        
+    def scatterActive(self, result):
+        '''
+        Scatters the results of the active cells back to 
+        the grid. Inactive cells are set to nan. Does nothing
+        if the active-cell mode is disabled.
+        
+        Parameters
+        ----------
+        result : ndarray
+            Array with the active cells on the last axis
+            
+        Returns
+        ----------
+        grid : ndarray
+            Array with (y, x) as last axes
+        '''
+        if not self.activeCellsFlag:
+            return result
+            
+        y0, y1, x0, x1 = self.activeBox
+        lead = result.shape[:-1]
+        
+        box = np.full(lead + ((y1 - y0) * (x1 - x0),), np.nan)
+        box[..., self.activeCells] = result
+        
+        grid = np.full(lead + self.gridShape, np.nan)
+        grid[..., y0:y1, x0:x1] = box.reshape(lead + (y1 - y0, x1 - x0))
+        
+        return grid
 
 
     def __setSourceDatesIdx(self, srcDates):
@@ -351,11 +1554,11 @@ class NcManager(object):
 
     def __createBoolDateVec(self):
         '''
-        Creates a boolean date vector between
-        user start and user end. Turns true if the
-        dates to analyse are in this range. E.g. this
-        is needed if a period over one year is chosen
-        and only a specific season has to be analysed.
+        Creates a boolean date vector aligned with the
+        source dates. Turns true if the dates to analyse
+        are in this range. E.g. this is needed if a period
+        over one year is chosen and only a specific season
+        has to be analysed.
         
         Returns
         ----------
@@ -364,13 +1567,7 @@ class NcManager(object):
             further processing.
             False = Dates that shouldn´t be included
         '''      
-        boolArr = np.array([], dtype=bool)
-        
-        for date in self.userDateVec:
-            if date in self.datesToAnalyse:
-                boolArr = np.append(boolArr, True)
-            else:
-                boolArr = np.append(boolArr, False)
+        boolArr = np.asarray(self.sourceDates.isin(self.datesToAnalyse), dtype=bool)
 
         return boolArr
 
@@ -428,26 +1625,27 @@ class NcManager(object):
             if not isinstance(s, list):
                 raise ValueError("Period parameter must be of type array!") 
             
+            if len(s) == 0:
+                print "No period set. Continuing with default 12-3"
+                s = [None, None, 12, 3, 0]
+                
             ds = s[0]
             de = s[1]
             ms = s[2]
             me = s[3]
             y  = s[4]
             
-            isMonthSet = (ms != 0 or ms is not None) and (me != 0 or me is not None) 
-            isDaySet = (ds != 0 or ds is not None) and (de != 0 or de is not None)
+            isMonthSet = ms not in (0, None) and me not in (0, None) 
+            isDaySet = ds not in (0, None) and de not in (0, None)
             
-            if len(s) == 0:
-                print "No period set. Continuing with default 12-3"
-                self.period = {"start": 12, "end": 3, "yearRange": 0}
-            elif (isDaySet and isMonthSet):
+            if (isDaySet and isMonthSet):
                 self.period = {"dayStart": ds, "dayEnd": de,"monthStart": ms, "monthEnd": me, "yearRange": y}
             elif isMonthSet:
                 self.period = {"dayStart": 1, "dayEnd": None, "monthStart": ms, "monthEnd": me, "yearRange": y}
             else:   
                 raise ValueError("Wrong entries in parameter 'period'")
         except KeyError:
-            self.period = {"start": 12, "end": 3, "yearRange": 0}
+            self.period = {"dayStart": 1, "dayEnd": None, "monthStart": 12, "monthEnd": 3, "yearRange": 0}
             print "Parameter 'period' not set. Continuing with default 12-3"
         
         self.start = pd.to_datetime(start)
@@ -455,6 +1653,11 @@ class NcManager(object):
         self.userDateVec = pd.date_range(self.start, self.end)
         #self.chunkIdxContainer = self.__createChunkIndexes(self.userDateVec)
     
+        if self.incrementalFlag and self.end > self.sourceDates[-1]:
+            print("End time " + str(self.end) + " is after the end of the source. Incremental mode continues with " + str(self.sourceDates[-1]))
+            self.end = self.sourceDates[-1]
+            self.userDateVec = pd.date_range(self.start, self.end)
+            
         if self.end > self.sourceDates[-1]:
             raise Exception("End time: " + str(self.end) + " is out of bounds. Bound end is " + str(self.sourceDates[-1]))
         
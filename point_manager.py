@@ -38,7 +38,7 @@ class Point(PointManager):
         return self.val 
  
  
-    def extractPtVal(self, frame):
+    def extractPtVal(self, frame, idx=None):
         '''
         Extracts the value of the calculation result
         for the specific point coordinates.
@@ -47,13 +47,19 @@ class Point(PointManager):
         ----------
         frame : ndarray
             The frame from where the data gets extracted. 
+        idx : tuple
+            The (yIdx, xIdx) of the point within the frame,
+            if the frame does not cover the whole grid.
             
         Returns
         ----------
         val : float
             The single point value. 
         '''
-        val = frame[self.__yIdx, self.__xIdx]
+        if idx is None:
+            idx = (self.__yIdx, self.__xIdx)
+            
+        val = frame[idx[0], idx[1]]
         self.__setPointVal(val)
         return val
         
@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import multiprocessing
+import argparse
+
+class ResourceEstimator(object):
+    '''
+    Class for estimating the resources of a run before it
+    is started (dry run). From the shapes, datatypes and
+    chunking of the source variables and the periods of the
+    nc_manager the bytes read from disk, the peak memory of
+    one period and the output size are predicted. From the
+    estimate the execution settings (row bands, workers and
+    prefetch depth) are chosen to fit a memory budget.
+    '''
+    def __init__(self, nc_manager):
+        '''
+        Parameters
+        ----------
+        nc_manager : nc_manager.NcManager
+            The manager with the source file and the periods
+            (setTimeSpan() has to be called before)
+        '''
+        self.nc_manager = nc_manager
+        self.maxPrefetchDepth = 2
+
+
+    def estimate(self, varsToBeAnalysed):
+        '''
+        Estimates the resources of the analysis of the
+        variables.
+
+        Parameters
+        ----------
+        varsToBeAnalysed : list
+            The variables with their functions as passed to
+            StatsUnivariat.setVariablesToAnalyse()
+
+        Returns
+        ----------
+        estimate : dict
+            Per variable ("vars") the bytes read from disk
+            (chunk aligned), the peak bytes of one period and
+            the output bytes, plus the totals and the row
+            bytes used for tuning
+        '''
+        nc_manager = self.nc_manager
+
+        if nc_manager.spanStartSpanEnd is None:
+            if nc_manager.start is None:
+                raise ValueError("No periods set. Call NcManager.setTimeSpan() before estimating.")
+
+            nc_manager.createDateRanges(nc_manager.period)
+
+        ny, nx = nc_manager.getWindowShape()
+        periods = [nc_manager.getPeriodRange(p) for p in nc_manager.spanStartSpanEnd]
+        steps = nc_manager.dayStartSteps
+        maxDays = max([end - start for start, end in periods] or [0])
+
+        estimate = {"vars": {}, "bytesRead": 0, "peakBytes": 0, "rowBytes": 0, "outputBytes": 0, "periods": len(periods)}
+
+        for var in varsToBeAnalysed:
+            if var["var"] == "skip":
+                continue
+
+            variable = nc_manager.src.variables[var["var"]]
+
+            packed = "scale_factor" in variable.ncattrs() or "add_offset" in variable.ncattrs()
+            rawFlag = nc_manager.packedIOFlag and not nc_manager.subDailyFlag
+
+            # Sub-daily data is resampled to daily float64 values while reading and
+            # packed data is unpacked to float64 (unless it is reduced raw)
+            itemsize = 8 if nc_manager.subDailyFlag or (packed and not rawFlag) else variable.dtype.itemsize
+
+            # Slab, boolean date selection and the copy of the reduction
+            # functions on the source scale plus one float64 working array
+            rowBytes = maxDays * nx * (3 * itemsize + 8)
+
+            if nc_manager.subDailyFlag:
+                stepsPerDay = float(len(nc_manager.stepDates)) / len(nc_manager.sourceDates)
+                rowBytes += nc_manager.resampleChunkDays * stepsPerDay * nx * 8
+
+            rowBytes = int(rowBytes)
+            bytesRead = sum(self.__chunkAlignedBytes(variable, steps[start], steps[end], ny, nx) for start, end in periods)
+            outputBytes = len(periods) * ny * nx * 4
+
+            estimate["vars"][var["var"]] = {"shape": variable.shape, "dtype": str(variable.dtype), "chunking": variable.chunking(), "dimensions": variable.dimensions,
+                                            "bytesRead": bytesRead, "peakBytes": rowBytes * ny, "rowBytes": rowBytes,
+                                            "slabBytes": maxDays * ny * nx * itemsize, "outputBytes": outputBytes}
+
+            estimate["bytesRead"] += bytesRead
+            estimate["outputBytes"] += outputBytes
+            estimate["peakBytes"] = max(estimate["peakBytes"], rowBytes * ny)
+            estimate["rowBytes"] = max(estimate["rowBytes"], rowBytes)
+
+        return estimate
+
+
+    def __chunkAlignedBytes(self, variable, startStep, endStep, ny, nx):
+        '''
+        Bytes read from disk for a time range. Chunked
+        variables are read in whole chunks. Dimensions other
+        than time, y and x are read completely.
+        '''
+        if endStep <= startStep:
+            return 0
+
+        chunking = variable.chunking()
+
+        if chunking == "contiguous" or chunking is None:
+            chunking = [None] * variable.ndim
+
+        nbytes = variable.dtype.itemsize
+
+        for dim, size, c in zip(variable.dimensions, variable.shape, chunking):
+            if dim == "time":
+                nbytes *= (endStep - startStep) if c is None else ((endStep - 1) // c - startStep // c + 1) * c
+            elif dim in ("y", "x"):
+                n = ny if dim == "y" else nx
+                nbytes *= n if c is None else -(-n // c) * c
+            else:
+                nbytes *= size
+
+        return nbytes
+
+
+    def tune(self, varsToBeAnalysed, memoryBudget, maxWorkers=None):
+        '''
+        Chooses the execution settings to fit a memory budget.
+        If the peak of a whole period does not fit, the grid
+        is processed in bands of rows (aligned to the spatial
+        chunks if possible). The remaining budget is used to
+        prefetch slabs of the next periods. The number of
+        workers is the number of tiles (see TileManager)
+        which can be processed in parallel within the budget.
+
+        Parameters
+        ----------
+        varsToBeAnalysed : list
+            The variables with their functions
+        memoryBudget : int
+            The memory budget in bytes
+        maxWorkers : int
+            The maximum number of workers. Defaults to the
+            number of cpus
+
+        Returns
+        ----------
+        tuning : dict
+            "tileRows" (None for the whole grid), "bands",
+            "prefetchDepth", "workers" and the "estimate"
+        '''
+        estimate = self.estimate(varsToBeAnalysed)
+        ny, nx = self.nc_manager.getWindowShape()
+        rowBytes = max(estimate["rowBytes"], 1)
+        slabBytes = max([v["slabBytes"] for v in estimate["vars"].values()] or [0])
+
+        if rowBytes > memoryBudget:
+            raise ValueError("A single row of the longest period needs " + self.formatBytes(rowBytes) + ", which exceeds the budget of " + self.formatBytes(memoryBudget) + ".")
+
+        tileRows = min(ny, int(memoryBudget // rowBytes))
+        chunkRows = [dict(zip(v["dimensions"], v["chunking"])).get("y") for v in estimate["vars"].values() if v["chunking"] not in ("contiguous", None)]
+        chunkRows = [cy for cy in chunkRows if cy]
+
+        if tileRows < ny and chunkRows:
+            cy = chunkRows[0]
+
+            if tileRows >= cy:
+                tileRows -= tileRows % cy
+
+        bands = -(-ny // tileRows)
+
+        if bands == 1:
+            # Each prefetched slab is held on top of the peak of the current period
+            freeBytes = memoryBudget - estimate["peakBytes"]
+            prefetchDepth = min(self.maxPrefetchDepth, int(freeBytes // max(slabBytes, 1)))
+            tileRows = None
+        else:
+            prefetchDepth = 0
+
+        if maxWorkers is None:
+            maxWorkers = multiprocessing.cpu_count()
+
+        workerBytes = rowBytes * (ny if tileRows is None else tileRows)
+        workers = int(max(1, min(maxWorkers, ny, memoryBudget // max(workerBytes, 1))))
+
+        return {"tileRows": tileRows, "bands": bands, "prefetchDepth": prefetchDepth, "workers": workers, "estimate": estimate}
+
+
+    def formatBytes(self, nbytes):
+        for unit in ("B", "KiB", "MiB", "GiB"):
+            if nbytes < 1024:
+                return "%.1f %s" % (nbytes, unit)
+            nbytes /= 1024.0
+
+        return "%.1f TiB" % nbytes
+
+
+    def printReport(self, tuning):
+        '''
+        Prints the estimate and the chosen settings.
+
+        Parameters
+        ----------
+        tuning : dict
+            The result of tune()
+        '''
+        estimate = tuning["estimate"]
+
+        print("Periods: " + str(estimate["periods"]))
+
+        for varName, var in sorted(estimate["vars"].items()):
+            print(varName + " " + str(var["shape"]) + " " + var["dtype"] + " chunking " + str(var["chunking"]) +
+                  ": read " + self.formatBytes(var["bytesRead"]) + ", peak per period " + self.formatBytes(var["peakBytes"]) +
+                  ", output " + self.formatBytes(var["outputBytes"]))
+
+        print("Total: read " + self.formatBytes(estimate["bytesRead"]) + ", peak per period " + self.formatBytes(estimate["peakBytes"]) +
+              ", output " + self.formatBytes(estimate["outputBytes"]))
+        print("Settings: tile rows " + str(tuning["tileRows"] or "all") + " (" + str(tuning["bands"]) + " bands), prefetch depth " +
+              str(tuning["prefetchDepth"]) + ", workers " + str(tuning["workers"]))
+
+
+def parseBytes(value):
+    '''
+    Parses a byte size like "512M" or "4G".
+    '''
+    units = {"K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+    value = value.strip().upper().rstrip("B")
+
+    if value and value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+
+    return int(value)
+
+
+if __name__== "__main__":
+    from nc_manager import NcManager
+
+    parser = argparse.ArgumentParser(description="Estimates the resources of a run and chooses the execution settings (dry run).")
+    parser.add_argument("workingDir", help="The working directory")
+    parser.add_argument("source", help="Path of the source file (relative to the working directory)")
+    parser.add_argument("start", help="Start date (E.g. 2000-01-01)")
+    parser.add_argument("end", help="End date (E.g. 2010-12-31)")
+    parser.add_argument("--period", nargs=5, default=["None", "None", "12", "3", "0"], help="dayStart dayEnd monthStart monthEnd yearRange")
+    parser.add_argument("--vars", nargs="+", required=True, help="The variables to analyse")
+    parser.add_argument("--budget", default="4G", help="Memory budget (E.g. 512M, 4G)")
+    parser.add_argument("--workers", type=int, default=None, help="Maximum number of workers")
+    args = parser.parse_args()
+
+    nc_manager = NcManager(args.workingDir, args.source, None)
+    nc_manager.setTimeSpan(args.start, args.end, period=[None if p == "None" else int(p) for p in args.period])
+
+    estimator = ResourceEstimator(nc_manager)
+    estimator.printReport(estimator.tune([{"var": v} for v in args.vars], parseBytes(args.budget), args.workers))
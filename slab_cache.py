@@ -0,0 +1,161 @@
+import numpy as np
+from collections import OrderedDict
+
+class SlabCache(object):
+    '''
+    In-process cache for the daily slabs read from the source
+    variables. The slabs are stored as disjoint segments of
+    days per key (file, variable, spatial window, ...). A
+    request is served from the cached segments as far as
+    possible, only the missing days are read from disk. The
+    segments are evicted in least recently used order when
+    the byte budget is exceeded.
+    '''
+    def __init__(self, budgetBytes):
+        '''
+        Parameters
+        ----------
+        budgetBytes : int
+            The maximum number of bytes held in the cache
+
+        Attributes
+        ----------
+        segments : OrderedDict
+            The cached arrays per (key, startIdx, endIdx) in
+            least recently used order
+        hits : int
+            Number of requests served completely from the cache
+        partialHits : int
+            Number of requests served partly from the cache
+        misses : int
+            Number of requests read completely from disk
+        bytesCached : int
+            Bytes served from the cache
+        bytesRead : int
+            Bytes read from disk
+        '''
+        self.budgetBytes = budgetBytes
+        self.segments = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.partialHits = 0
+        self.misses = 0
+        self.bytesCached = 0
+        self.bytesRead = 0
+
+
+    def get(self, key, startIdx, endIdx, readFunc):
+        '''
+        Returns the slab of the days [startIdx, endIdx). The
+        days which are not cached are read with readFunc and
+        added to the cache.
+
+        Parameters
+        ----------
+        key : tuple
+            Hashable key of the slab without the time range
+        startIdx : int
+            Index of the first day
+        endIdx : int
+            Index after the last day
+        readFunc : function
+            Reads the days [start, end) from disk:
+            readFunc(start, end) -> ndarray (days, ...)
+
+        Returns
+        ----------
+        data : ndarray
+            The slab (a copy, the cached arrays are never
+            handed out)
+        '''
+        startIdx, endIdx = int(startIdx), int(endIdx)
+
+        cached = sorted((s, e) for k, s, e in self.segments if k == key and s < endIdx and e > startIdx)
+        pieces = []
+        pos = startIdx
+
+        for s, e in cached:
+            if s > pos:
+                pieces.append((pos, s, None))
+            pieces.append((max(s, pos), min(e, endIdx), (key, s, e)))
+            pos = e
+
+        if pos < endIdx:
+            pieces.append((pos, endIdx, None))
+
+        data = None
+        fromCache = 0
+        fromDisk = 0
+
+        for s, e, segKey in pieces:
+            if segKey is None:
+                chunk = np.asarray(readFunc(s, e))
+                self.__add((key, s, e), chunk)
+                fromDisk += chunk.nbytes
+            else:
+                segment = self.segments[segKey]
+                self.segments[segKey] = self.segments.pop(segKey)
+                chunk = segment[s-segKey[1]:e-segKey[1]]
+                fromCache += chunk.nbytes
+
+            if data is None:
+                data = np.empty((endIdx - startIdx,) + chunk.shape[1:], dtype=chunk.dtype)
+
+            data[s-startIdx:e-startIdx] = chunk
+
+        if fromDisk == 0:
+            self.hits += 1
+        elif fromCache == 0:
+            self.misses += 1
+        else:
+            self.partialHits += 1
+
+        self.bytesCached += fromCache
+        self.bytesRead += fromDisk
+        self.__evict()
+
+        return data
+
+
+    def __add(self, segKey, chunk):
+        '''
+        Adds a segment to the cache. Segments larger than
+        the budget are not cached.
+        '''
+        if chunk.nbytes > self.budgetBytes:
+            return
+
+        self.segments[segKey] = chunk
+        self.nbytes += chunk.nbytes
+
+
+    def __evict(self):
+        '''
+        Removes the least recently used segments until the
+        cache fits into the budget.
+        '''
+        while self.nbytes > self.budgetBytes and self.segments:
+            segKey, chunk = self.segments.popitem(last=False)
+            self.nbytes -= chunk.nbytes
+
+
+    def clear(self):
+        '''
+        Removes all segments (the counters are kept).
+        '''
+        self.segments.clear()
+        self.nbytes = 0
+
+
+    def getStats(self):
+        '''
+        Returns the counters of the cache.
+
+        Returns
+        ----------
+        stats : dict
+            hits, partialHits, misses, bytesCached, bytesRead
+            and the current size in bytes
+        '''
+        return {"hits": self.hits, "partialHits": self.partialHits, "misses": self.misses,
+                "bytesCached": self.bytesCached, "bytesRead": self.bytesRead, "nbytes": self.nbytes}
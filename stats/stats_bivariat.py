@@ -0,0 +1,252 @@
+import numpy as np
+from stats.stats_univariat import *
+
+class StatsBivariat(StatsUnivariat):
+    '''
+    This class handles the bivariat statistical analysis
+    of variable pairs per period and cell (correlation,
+    covariance and linear regression). Every variable is
+    read only once per period, no matter in how many pairs
+    it is used. The cross-moments are accumulated chunkwise
+    along the time axis, only days where both variables
+    are valid (not nan or fill) are used.
+    '''
+    def __init__(self, nc_manager, point_manager, ofPath):
+        '''
+        Parameters
+        ----------
+        nc_manager : nc_manager.NcManager
+            The manager for the src and dst ncfile
+        point_manager : point_manager.PointManager
+            Handler for the points
+        ofPath : string
+            The output path
+        '''
+        StatsUnivariat.__init__(self, nc_manager, point_manager, ofPath)
+        self.pairsToBeAnalysed = []
+        self.srcVars = {}
+        self.chunkSize = 365
+
+
+    def setPairsToAnalyse(self, pairs):
+        '''
+        Stores the variable pairs to be analysed and their
+        functions and initializes the output file.
+
+        Parameters
+        ----------
+        pairs : list
+            List of dicts with the variable pair (x, y) and
+            the functions to be applied ("corr", "cov", "regr")
+            E.g. [{"vars": ["tas", "asmh"], "func": ["corr", "regr"]}]
+        '''
+        nc_manager = self.nc_manager
+        self.pairsToBeAnalysed = []
+
+        for pair in pairs:
+            xName, yName = pair["vars"]
+
+            for func in pair["func"]:
+                if func not in ("corr", "cov", "regr"):
+                    raise ValueError("Function '" + func + "' to be applied on pair '" + xName + "', '" + yName + "' not known.")
+
+            try:
+                for varName in (xName, yName):
+                    self.srcVars[varName] = nc_manager.src.variables[varName]
+            except KeyError:
+                print("Variable '" + varName + "' not found in datafile. Continues with next pair...")
+                continue
+
+            self.pairsToBeAnalysed.append(pair)
+
+        nc_manager.initializeOutputFile(self.ofPath, [])
+
+        for pair in self.pairsToBeAnalysed:
+            for name, attrs in self.__outputVars(pair).items():
+                nc_manager.addOutputVariable(name, pair["vars"][0], datatype="f4", attrs=attrs, derived=True)
+
+
+    def __outputVars(self, pair):
+        '''
+        Returns the names and attributes of the output
+        variables of a pair (E.g. "tas_asmh_[corr]").
+        '''
+        xName, yName = pair["vars"]
+        xUnits = self.__units(xName)
+        yUnits = self.__units(yName)
+        prefix = xName + "_" + yName + "_["
+        outputVars = {}
+
+        for func in pair["func"]:
+            if func == "corr":
+                outputVars[prefix + "corr]"] = {"long_name": "correlation of " + xName + " and " + yName, "units": "1"}
+            elif func == "cov":
+                outputVars[prefix + "cov]"] = {"long_name": "covariance of " + xName + " and " + yName, "units": xUnits + " " + yUnits}
+            elif func == "regr":
+                outputVars[prefix + "regr_slope]"] = {"long_name": "regression slope of " + yName + " on " + xName, "units": yUnits + "/" + xUnits}
+                outputVars[prefix + "regr_intercept]"] = {"long_name": "regression intercept of " + yName + " on " + xName, "units": yUnits}
+
+        return outputVars
+
+
+    def __units(self, varName):
+        variable = self.srcVars[varName]
+
+        return variable.units if "units" in variable.ncattrs() else ""
+
+
+    def __readValid(self, varName, startIdx, endIdx, boolArr):
+        '''
+        Reads a chunk of a variable and its validity mask
+        (not nan and not fill).
+        '''
+        nc_manager = self.nc_manager
+        variable = self.srcVars[varName]
+
+        data = np.asarray(nc_manager.readSlab(variable, startIdx, endIdx)[boolArr], dtype=np.float64)
+        valid = np.isfinite(data)
+
+        scale, offset, fill = nc_manager.getPacking(variable)
+
+        if fill is not None:
+            valid &= data != fill * scale + offset
+
+        return data, valid
+
+
+    def calcPeriod(self, period):
+        '''
+        Accumulates the moments of all pairs for one
+        period. The period is read in chunks along the
+        time axis, every variable once per chunk, and the
+        moments of the pairs are accumulated.
+
+        Parameters
+        ----------
+        period : dict
+            The period with start and end date
+
+        Returns
+        ----------
+        moments : dict
+            The accumulated moments (n, sx, sy, sxx, syy, sxy)
+            per pair index
+        '''
+        nc_manager = self.nc_manager
+
+        periodStartIdx, periodEndIdx = nc_manager.getPeriodRange(period)
+
+        varNames = sorted(set(v for pair in self.pairsToBeAnalysed for v in pair["vars"]))
+        moments = {}
+
+        for chunkStart in range(periodStartIdx, periodEndIdx, self.chunkSize):
+            chunkEnd = min(chunkStart + self.chunkSize, periodEndIdx)
+            boolArr = nc_manager.boolDateVec[chunkStart:chunkEnd]
+
+            if not boolArr.any():
+                continue
+
+            chunk = dict((varName, self.__readValid(varName, chunkStart, chunkEnd, boolArr)) for varName in varNames)
+
+            for i, pair in enumerate(self.pairsToBeAnalysed):
+                x, xValid = chunk[pair["vars"][0]]
+                y, yValid = chunk[pair["vars"][1]]
+
+                valid = xValid & yValid
+                x = np.where(valid, x, 0)
+                y = np.where(valid, y, 0)
+
+                acc = {"n": valid.sum(axis=0), "sx": x.sum(axis=0), "sy": y.sum(axis=0),
+                       "sxx": (x * x).sum(axis=0), "syy": (y * y).sum(axis=0), "sxy": (x * y).sum(axis=0)}
+
+                if i not in moments:
+                    moments[i] = acc
+                else:
+                    for k in acc:
+                        moments[i][k] = moments[i][k] + acc[k]
+
+        return moments
+
+
+    def calcStatistics(self, pair, moments):
+        '''
+        Calculates the statistics of a pair from the
+        accumulated moments.
+
+        Parameters
+        ----------
+        pair : dict
+            The pair with its functions
+        moments : dict
+            The moments as returned by calcPeriod()
+
+        Returns
+        ----------
+        results : dict
+            The result frames per output variable name
+        '''
+        n = moments["n"].astype(np.float64)
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            cxy = (moments["sxy"] - moments["sx"] * moments["sy"] / n) / (n - 1)
+            vx = (moments["sxx"] - moments["sx"] ** 2 / n) / (n - 1)
+            vy = (moments["syy"] - moments["sy"] ** 2 / n) / (n - 1)
+
+            corr = cxy / np.sqrt(vx * vy)
+            slope = cxy / vx
+            intercept = moments["sy"] / n - slope * moments["sx"] / n
+
+        insufficient = n < 2
+        names = sorted(self.__outputVars(pair).keys())
+        results = {}
+
+        for name in names:
+            if name.endswith("[corr]"):
+                result = corr
+            elif name.endswith("[cov]"):
+                result = cxy
+            elif name.endswith("[regr_slope]"):
+                result = slope
+            else:
+                result = intercept
+
+            result = np.where(insufficient, np.nan, result)
+            results[name] = self.nc_manager.scatterActive(result)
+
+        return results
+
+
+    def calcAll(self):
+        '''
+        Calculates the statistics of all pairs period by
+        period and writes the results to csv and ncfile.
+        '''
+        nc_manager = self.nc_manager
+
+        if not self.pairsToBeAnalysed:
+            print('There is no pair to analyse.')
+
+        outputVars = []
+
+        for pair in self.pairsToBeAnalysed:
+            for name in sorted(self.__outputVars(pair).keys()):
+                funcName = name[name.rindex("[") + 1:-1]
+                outputVars.append({"var": name, "func": {"name": funcName, "props": []}, "data": nc_manager.dst.variables[name]})
+
+        csv = CsvManager(nc_manager.workingDir, nc_manager.spanStartSpanEnd, outputVars, self.getPoints(), self.fn)
+
+        print("Calculating pairs: " + ", ".join(pair["vars"][0] + "/" + pair["vars"][1] for pair in self.pairsToBeAnalysed))
+
+        for i, period in enumerate(nc_manager.spanStartSpanEnd):
+            moments = self.calcPeriod(period)
+
+            for p, pair in enumerate(self.pairsToBeAnalysed):
+                if p not in moments:
+                    continue
+
+                for name, result in self.calcStatistics(pair, moments[p]).items():
+                    self.collectPointValues(name, result, csv)
+                    nc_manager.writeToOutputFile(name, i, result)
+
+        csv.writeDataToFile(append=nc_manager.incrementalFlag)
+        nc_manager.closeOutputFile()
@@ -0,0 +1,312 @@
+import numpy as np
+import pandas as pd
+import warnings
+from stats.stats_univariat import *
+
+class StatsClimatology(StatsUnivariat):
+    '''
+    This class handles the day-of-year climatology
+    (mean and standard deviation per day of year over
+    a reference period) and the anomalies of the user
+    defined periods against it.
+
+    The functions to be applied are "anomaly" (mean
+    anomaly) and "stdanomaly" (mean standardized anomaly).
+    '''
+    def __init__(self, nc_manager, point_manager, ofPath):
+        '''
+        Parameters
+        ----------
+        nc_manager : nc_manager.NcManager
+            The manager for the src and dst ncfile
+        point_manager : point_manager.PointManager
+            Handler for the points
+        ofPath : string
+            The output path
+        '''
+        StatsUnivariat.__init__(self, nc_manager, point_manager, ofPath)
+        self.refStart = None
+        self.refEnd = None
+        self.smoothWindow = 1
+        self.chunkSize = 365
+        self.climatology = {}
+        self.dayOfYearGroups = None
+
+
+    def setReferencePeriod(self, start, end):
+        '''
+        Sets the reference period of the climatology.
+
+        Parameters
+        ----------
+        start : string
+            Reference start date (E.g. "1981-01-01")
+        end : string
+            Reference end date, inclusive (E.g. "2010-12-31")
+        '''
+        nc_manager = self.nc_manager
+
+        self.refStart = pd.to_datetime(start)
+        self.refEnd = pd.to_datetime(end)
+
+        if self.refStart < nc_manager.sourceDates[0] or self.refEnd > nc_manager.sourceDates[-1]:
+            raise Exception("Reference period " + str(self.refStart) + " - " + str(self.refEnd) + " is out of bounds. Bounds are " + str(nc_manager.sourceDates[0]) + " - " + str(nc_manager.sourceDates[-1]))
+
+
+    def setSmoothing(self, window):
+        '''
+        Sets the width of the circular moving window which
+        smooths the climatology along the day-of-year axis.
+
+        Parameters
+        ----------
+        window : int
+            Odd number of days. 1 means no smoothing.
+        '''
+        if window < 1 or window % 2 == 0:
+            raise ValueError("Smoothing window must be an odd number >= 1")
+
+        self.smoothWindow = window
+
+
+    def setVariablesToAnalyse(self, vars_):
+        '''
+        Stores the variables to be analysed and adds
+        the day-of-year dimension and the climatology
+        variables to the output file.
+
+        Parameters
+        ----------
+        vars_ : ndarray
+            Array of dicts with varname and statics
+            function to be applied.
+        '''
+        StatsUnivariat.setVariablesToAnalyse(self, vars_)
+
+        nc_manager = self.nc_manager
+        nc_manager.addOutputDimension("dayofyear", 366)
+
+        if "dayofyear" not in nc_manager.dst.variables:
+            doy = nc_manager.dst.createVariable("dayofyear", "i", ("dayofyear",))
+            doy.long_name = "day of year (February 29th = 60)"
+            doy[:] = np.arange(1, 367)
+
+        for var in vars_:
+            varName = var["var"]
+            if varName == "skip":
+                continue
+            dims = ("dayofyear",) + var["data"].dimensions[1:]
+            nc_manager.addOutputVariable(varName + "_[clim_mean]", varName, dims, "f8")
+            nc_manager.addOutputVariable(varName + "_[clim_std]", varName, dims, "f8")
+
+
+    def calcClimatology(self, varName, varToBeAnalysed):
+        '''
+        Calculates the day-of-year climatology in a single
+        pass over the reference period. The reference period
+        is read chunkwise and the sums, squared sums and
+        counts are accumulated per day-of-year group.
+
+        Parameters
+        ----------
+        varName : string
+            Variable name
+        varToBeAnalysed : netCDF4._netCDF4.Variable
+            Raw nc variable
+
+        Returns
+        ----------
+        clim : dict
+            Dict with the climatological "mean" and "std"
+            (366, y, x)
+        '''
+        if varName in self.climatology:
+            return self.climatology[varName]
+
+        nc_manager = self.nc_manager
+
+        if self.refStart is None:
+            raise ValueError("No reference period set. Set it with StatsClimatology().setReferencePeriod(start, end)")
+
+        print("Calculating climatology: " + varName)
+
+        groups = self.__getDayOfYearGroups()
+        refStartIdx = nc_manager.sourceDatesIdx[self.refStart]
+        refEndIdx = nc_manager.sourceDatesIdx[self.refEnd] + 1
+
+        sums = None
+
+        for chunkStart in range(refStartIdx, refEndIdx, self.chunkSize):
+            chunkEnd = min(chunkStart + self.chunkSize, refEndIdx)
+
+            data = self.__readMasked(varToBeAnalysed, chunkStart, chunkEnd)
+            chunkGroups = groups[chunkStart:chunkEnd]
+
+            valid = np.isfinite(data)
+            data[~valid] = 0
+
+            if sums is None:
+                shape = (366,) + data.shape[1:]
+                sums = np.zeros(shape)
+                sumsSq = np.zeros(shape)
+                counts = np.zeros(shape, dtype=np.int32)
+
+            np.add.at(sums, chunkGroups, data)
+            np.add.at(sumsSq, chunkGroups, data * data)
+            np.add.at(counts, chunkGroups, valid.astype(np.int32))
+
+        if self.smoothWindow > 1:
+            sums = self.__smooth(sums, self.smoothWindow)
+            sumsSq = self.__smooth(sumsSq, self.smoothWindow)
+            counts = self.__smooth(counts, self.smoothWindow)
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean_ = sums / counts
+            var_ = sumsSq / counts - mean_ * mean_
+
+        std_ = np.sqrt(np.clip(var_, 0, None))
+
+        clim = {"mean": mean_, "std": std_}
+        self.climatology[varName] = clim
+
+        nc_manager.writeOutputVariable(varName + "_[clim_mean]", nc_manager.scatterActive(mean_))
+        nc_manager.writeOutputVariable(varName + "_[clim_std]", nc_manager.scatterActive(std_))
+
+        return clim
+
+
+    def calcAnomaly(self, func, data, groups, clim):
+        '''
+        Calculates the mean anomaly of the data against
+        the climatology. Either the absolute ("anomaly")
+        or the standardized anomaly ("stdanomaly").
+
+        Parameters
+        ----------
+        func : dict
+            Dict with information about the statistical
+            function to be applied like name and properties
+        data : ndarray
+            Three dimensional array with the dataframes
+        groups : ndarray
+            The day-of-year group of each dataframe
+        clim : dict
+            The climatology as returned by calcClimatology()
+
+        Returns
+        ----------
+        anomaly : ndarray
+            Array with the mean anomaly
+        '''
+        anomalies = data - clim["mean"][groups]
+
+        if func["name"] == "stdanomaly":
+            std_ = clim["std"][groups]
+            std_[std_ == 0] = np.nan
+            anomalies /= std_
+
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", category=RuntimeWarning)
+            anomaly = np.nanmean(anomalies, axis = 0)
+
+        return anomaly
+
+
+    def calcAll(self):
+        '''
+        Calculates the climatology once per variable and
+        the anomalies for every period and writes the
+        results to csv and ncfile.
+        '''
+        nc_manager = self.nc_manager
+        varsToBeAnalysed = self.varsToBeAnalysed
+
+        if not varsToBeAnalysed:
+            print('There is no Variable to analyse.')
+
+        csv = CsvManager(nc_manager.workingDir, nc_manager.spanStartSpanEnd, varsToBeAnalysed, self.getPoints(), self.fn)
+        groups = self.__getDayOfYearGroups()
+
+        for var in varsToBeAnalysed:
+            varName = var["var"]
+
+            if varName == "skip":
+                continue
+
+            func = var["func"]
+
+            if func["name"] not in ("anomaly", "stdanomaly"):
+                raise ValueError("Function '" + func["name"] + "' to be applied on variable '" + varName + "' not known.")
+
+            clim = self.calcClimatology(varName, var["data"])
+            ncVarName = nc_manager.createOutputVarName(varName, func)
+
+            print("Calculating anomalies: " + varName)
+
+            for i, period in enumerate(nc_manager.spanStartSpanEnd):
+                periodStartIdx, periodEndIdx = nc_manager.getPeriodRange(period)
+
+                boolArr = nc_manager.boolDateVec[periodStartIdx:periodEndIdx]
+                data = self.__readMasked(var["data"], periodStartIdx, periodEndIdx)[boolArr]
+                periodGroups = groups[periodStartIdx:periodEndIdx][boolArr]
+
+                result = nc_manager.scatterActive(self.calcAnomaly(func, data, periodGroups, clim))
+
+                self.collectPointValues(varName, result, csv)
+
+                nc_manager.writeToOutputFile(ncVarName, i, result)
+
+        csv.writeDataToFile(append=nc_manager.incrementalFlag)
+        nc_manager.closeOutputFile()
+
+
+    def __readMasked(self, variable, startIdx, endIdx):
+        '''
+        Reads the daily data of a variable as float64 with
+        the fill values set to nan, so they are excluded 
+        like missing values.
+        '''
+        nc_manager = self.nc_manager
+        data = np.asarray(nc_manager.readSlab(variable, startIdx, endIdx), dtype=np.float64)
+        scale, offset, fill = nc_manager.getPacking(variable)
+
+        if fill is not None:
+            data[data == fill * scale + offset] = np.nan
+
+        return data
+
+
+    def __getDayOfYearGroups(self):
+        if self.dayOfYearGroups is None:
+            self.dayOfYearGroups = self.nc_manager.createDayOfYearGroups(self.nc_manager.sourceDates)
+
+        return self.dayOfYearGroups
+
+
+    def __smooth(self, arr, window):
+        '''
+        Smooths the array along the day-of-year axis with
+        a circular moving sum, so that December and January
+        are treated as neighbours.
+
+        Parameters
+        ----------
+        arr : ndarray
+            Array with the day-of-year groups on axis 0
+        window : int
+            Odd window width in days
+
+        Returns
+        ----------
+        smoothed : ndarray
+            The moving sums with the same shape as arr
+        '''
+        half = window // 2
+        padded = np.concatenate((arr[-half:], arr, arr[:half]), axis=0)
+
+        csum = np.cumsum(padded, axis=0, dtype=np.float64)
+        csum = np.concatenate((np.zeros((1,) + arr.shape[1:]), csum), axis=0)
+
+        smoothed = csum[window:] - csum[:-window]
+
+        return smoothed
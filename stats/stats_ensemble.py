@@ -0,0 +1,236 @@
+import numpy as np
+import warnings
+from netCDF4 import Dataset
+from nc_manager import *
+from stats.stats_univariat import *
+
+class StatsEnsemble(StatsUnivariat):
+    '''
+    This class handles the ensemble statistics across
+    several model runs (members) with the same grid. For
+    every period and member the univariate function is
+    applied, and the member results are streamed into
+    running accumulators for the ensemble mean, spread
+    (standard deviation) and percentiles.
+
+    The source file of the nc_manager is the first member.
+    Its periods, grid and metadata are used for all members.
+    '''
+    def __init__(self, nc_manager, point_manager, ofPath):
+        '''
+        Parameters
+        ----------
+        nc_manager : nc_manager.NcManager
+            The manager for the src (first member) and dst ncfile
+        point_manager : point_manager.PointManager
+            Handler for the points
+        ofPath : string
+            The output path
+        '''
+        StatsUnivariat.__init__(self, nc_manager, point_manager, ofPath)
+        self.members = [{"name": "reference", "src": nc_manager.src, "reader": nc_manager}]
+        self.percentiles = [10, 50, 90]
+
+
+    def setMembers(self, ncPaths):
+        '''
+        Adds the other members of the ensemble. Members whose
+        time axis matches the time axis of the first member
+        reuse its decoded time index. Otherwise the time axis
+        of the member is decoded and the periods are looked
+        up by date.
+
+        Parameters
+        ----------
+        ncPaths : list
+            Paths of the member source files (relative to
+            the working directory)
+        '''
+        nc_manager = self.nc_manager
+        refTime = nc_manager.src.variables["time"]
+
+        for ncPath in ncPaths:
+            src = Dataset(nc_manager.workingDir + ncPath, mode="r", format="NETCDF4")
+            src.set_auto_mask(False)
+
+            for dim in ("y", "x"):
+                if len(src.dimensions[dim]) != len(nc_manager.src.dimensions[dim]):
+                    raise ValueError("Grid of member '" + ncPath + "' differs from the grid of the first member.")
+
+            time = src.variables["time"]
+
+            if time.units == refTime.units and np.array_equal(time[:], refTime[:]):
+                reader = nc_manager
+            else:
+                print("Time axis of member '" + ncPath + "' differs. Decoding its own time index.")
+                src.close()
+                reader = NcManager(nc_manager.workingDir, ncPath, None)
+                src = reader.src
+                self.__alignReader(reader)
+
+            self.members.append({"name": ncPath, "src": src, "reader": reader})
+
+
+    def __alignReader(self, reader):
+        '''
+        Copies the spatial settings of the nc_manager to the
+        reader of a member with a different time axis.
+        '''
+        nc_manager = self.nc_manager
+
+        reader.window = nc_manager.window
+        reader.stride = nc_manager.stride
+        reader.resampleMethods = nc_manager.resampleMethods
+        reader.activeCellsFlag = nc_manager.activeCellsFlag
+
+
+    def setPercentiles(self, percentiles):
+        '''
+        Sets the ensemble percentiles to be calculated.
+
+        Parameters
+        ----------
+        percentiles : list
+            Percentiles between 0 and 100 (E.g. [10, 50, 90])
+        '''
+        self.percentiles = list(percentiles)
+
+
+    def getEnsembleVarNames(self, ncVarName):
+        '''
+        Returns the names of the ensemble output variables
+        of an output variable (E.g. "asmh_[mean]_[ens_mean]").
+        '''
+        names = {"mean": ncVarName + "_[ens_mean]", "std": ncVarName + "_[ens_std]"}
+
+        for p in self.percentiles:
+            names["p" + str(p)] = ncVarName + "_[ens_p" + str(p) + "]"
+
+        return names
+
+
+    def initializeOutput(self, vars_):
+        '''
+        Initializes the output file with the ensemble
+        statistics variables.
+        '''
+        nc_manager = self.nc_manager
+        nc_manager.initializeOutputFile(self.ofPath, [])
+
+        for var in vars_:
+            if var["var"] == "skip":
+                continue
+
+            ncVarName = nc_manager.createOutputVarName(var["var"], var["func"])
+
+            for stat, name in self.getEnsembleVarNames(ncVarName).items():
+                longName = {"mean": "ensemble mean", "std": "ensemble standard deviation"}.get(stat, "ensemble percentile " + stat[1:])
+                nc_manager.addOutputVariable(name, var["var"], datatype="f4", attrs={"long_name": longName + " of " + ncVarName}, derived=True)
+
+
+    def __readMember(self, member, varName, period):
+        '''
+        Reads the period slab of a variable of one member.
+        '''
+        nc_manager = self.nc_manager
+        reader = member["reader"]
+
+        try:
+            periodStartIdx, periodEndIdx = reader.getPeriodRange(period)
+        except KeyError:
+            raise ValueError("Member '" + member["name"] + "' does not cover the period " + str(period["startDate"]) + " - " + str(period["endDate"]))
+
+        if reader is nc_manager:
+            boolDateVec = nc_manager.boolDateVec
+        else:
+            if reader.activeCellsFlag and reader.activeCells is None:
+                reader.activeCells = nc_manager.activeCells
+                reader.activeBox = nc_manager.activeBox
+                reader.gridShape = nc_manager.gridShape
+            boolDateVec = np.asarray(reader.sourceDates.isin(nc_manager.datesToAnalyse))
+
+        boolArr = boolDateVec[periodStartIdx:periodEndIdx]
+
+        return reader.readSlab(member["src"].variables[varName], periodStartIdx, periodEndIdx)[boolArr]
+
+
+    def __calcEnsemble(self, varName, funcToBeApplied, csv):
+        '''
+        Calculates the ensemble statistics iteratively for
+        each period. The members are read one after another
+        and their period results are accumulated with
+        Welford's algorithm (mean and spread). Only the
+        reduced member results are kept for the percentiles.
+
+        Parameters
+        ----------
+        varName : string
+            Variable name
+        funcToBeApplied : dict
+            The univariate function name and properties
+        csv : csv_manager.Csv
+            Manages the csv output
+        '''
+        nc_manager = self.nc_manager
+        ncVarName = nc_manager.createOutputVarName(varName, funcToBeApplied)
+        names = self.getEnsembleVarNames(ncVarName)
+
+        print("Calculating ensemble: " + varName + " (" + str(len(self.members)) + " members)")
+
+        for i, period in enumerate(nc_manager.spanStartSpanEnd):
+            results = None
+
+            for m, member in enumerate(self.members):
+                data = self.__readMember(member, varName, period)
+                result = np.asarray(self.applyFunc(varName, funcToBeApplied, data), dtype=np.float64)
+
+                if results is None:
+                    results = np.empty((len(self.members),) + result.shape)
+                    mean_ = np.zeros(result.shape)
+                    m2 = np.zeros(result.shape)
+
+                results[m] = result
+                delta = result - mean_
+                mean_ += delta / (m + 1)
+                m2 += delta * (result - mean_)
+
+            with np.errstate(invalid="ignore", divide="ignore"):
+                std_ = np.sqrt(m2 / (len(self.members) - 1))
+
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", category=RuntimeWarning)
+                pcts = np.nanpercentile(results, self.percentiles, axis=0)
+
+            mean_ = nc_manager.scatterActive(mean_)
+            self.collectPointValues(varName, mean_, csv)
+
+            nc_manager.writeToOutputFile(names["mean"], i, mean_)
+            nc_manager.writeToOutputFile(names["std"], i, nc_manager.scatterActive(std_))
+
+            for p, pct in zip(self.percentiles, pcts):
+                nc_manager.writeToOutputFile(names["p" + str(p)], i, nc_manager.scatterActive(pct))
+
+
+    def calcAll(self):
+        '''
+        Calculates the ensemble statistics for every
+        variable and writes the results to csv and ncfile.
+        The csv contains the ensemble mean.
+        '''
+        nc_manager = self.nc_manager
+        varsToBeAnalysed = self.varsToBeAnalysed
+
+        if not varsToBeAnalysed:
+            print('There is no Variable to analyse.')
+
+        csv = CsvManager(nc_manager.workingDir, nc_manager.spanStartSpanEnd, varsToBeAnalysed, self.getPoints(), self.fn)
+
+        for var in varsToBeAnalysed:
+            if var["var"] != "skip":
+                self.__calcEnsemble(var["var"], var["func"], csv)
+
+        csv.writeDataToFile(append=nc_manager.incrementalFlag)
+        nc_manager.closeOutputFile()
+
+        for member in self.members[1:]:
+            member["src"].close()
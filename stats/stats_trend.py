@@ -0,0 +1,249 @@
+import numpy as np
+import pandas as pd
+import math
+from netCDF4 import Dataset
+
+class StatsTrend(object):
+    '''
+    This class handles the per-pixel trend analysis across
+    the periods of a calculated output file (E.g. the output
+    of StatsUnivariat). For every cell the least-squares
+    slope, intercept and p-value as well as Sen's slope and
+    the Mann-Kendall p-value are calculated. The cells are
+    processed in batches, so the memory stays bounded.
+    '''
+    def __init__(self, ofPath):
+        '''
+        Parameters
+        ----------
+        ofPath : string
+            Path of the output file with the period statistics
+        '''
+        self.ofPath = ofPath
+        self.batchBytes = 256 * 1024**2
+
+
+    def setBatchBytes(self, batchBytes):
+        '''
+        Sets the memory budget of one batch of cells.
+
+        Parameters
+        ----------
+        batchBytes : int
+            The budget in bytes
+        '''
+        self.batchBytes = batchBytes
+
+
+    def calcTrends(self, varNames=None):
+        '''
+        Calculates the trends of the period statistics and
+        writes the trend grids to the output file. The time
+        axis is the middle of each period in years since the
+        middle of the first period, so slopes are per year
+        and intercepts are the fitted values of the first
+        period.
+
+        Parameters
+        ----------
+        varNames : list
+            The output variables to analyse (E.g. ["asmh_[mean]"]).
+            Defaults to all variables with a time dimension.
+        '''
+        dst = Dataset(self.ofPath, 'a', format="NETCDF4")
+
+        try:
+            years = self.__createYears(dst)
+
+            if len(years) < 3:
+                raise ValueError("At least 3 periods are needed for a trend analysis.")
+
+            if varNames is None:
+                varNames = [name for name, var in dst.variables.items() if var.ndim == 3 and var.dimensions[0] == "time"]
+
+            for varName in varNames:
+                print("Calculating trend: " + varName)
+                self.__calcVariableTrend(dst, varName, years)
+        finally:
+            dst.close()
+
+
+    def __createYears(self, dst):
+        '''
+        Creates the time axis of the trend analysis from the
+        time bounds (middle of each period in years since the
+        middle of the first period).
+        '''
+        bnds = np.asarray(dst.variables["time_bnds"][:], dtype=np.float64)
+        units = dst.variables["time_bnds"].units
+        daysSince = pd.to_datetime(units.split()[2])
+
+        mid = daysSince + pd.to_timedelta(bnds.mean(axis=1), unit="D")
+        years = np.asarray((mid - mid[0]).days, dtype=np.float64) / 365.25
+
+        return years
+
+
+    def __calcVariableTrend(self, dst, varName, years):
+        '''
+        Calculates the trends of one variable batchwise
+        (rows of the grid) and writes the trend variables.
+        '''
+        variable = dst.variables[varName]
+        n, ny, nx = variable.shape
+        spatialDims = variable.dimensions[1:]
+
+        names = ["trend_slope", "trend_intercept", "trend_pvalue", "sen_slope", "mk_pvalue"]
+        results = dict((name, np.full((ny, nx), np.nan, dtype=np.float32)) for name in names)
+
+        # The pairwise slopes of Sen's slope (list and concatenation) dominate the memory use
+        bytesPerCell = 8 * (n * (n - 1) + 4 * n)
+        rowsPerBatch = max(1, int(self.batchBytes // (bytesPerCell * nx)))
+
+        for rowStart in range(0, ny, rowsPerBatch):
+            rowEnd = min(rowStart + rowsPerBatch, ny)
+
+            data = variable[:, rowStart:rowEnd, :]
+            data = np.ma.filled(np.ma.asarray(data, dtype=np.float64), np.nan).reshape((n, -1))
+
+            valid = np.isfinite(data).all(axis=0)
+
+            if not valid.any():
+                continue
+
+            batch = self.calcBatch(years, data[:, valid])
+
+            for name in names:
+                frame = np.full(data.shape[1], np.nan)
+                frame[valid] = batch[name]
+                results[name][rowStart:rowEnd, :] = frame.reshape((rowEnd - rowStart, nx))
+
+        units = variable.units if "units" in variable.ncattrs() else ""
+
+        for name in names:
+            outName = varName + "_[" + name + "]"
+
+            if outName not in dst.variables:
+                out = dst.createVariable(outName, "f4", spatialDims, fill_value=np.float32(np.nan))
+                out.long_name = name.replace("_", " ") + " of " + varName
+
+                if name in ("trend_slope", "sen_slope"):
+                    out.units = units + "/year"
+                elif name == "trend_intercept":
+                    out.units = units
+
+            dst.variables[outName][:] = results[name]
+
+
+    def calcBatch(self, years, data):
+        '''
+        Calculates the trends for a batch of cells at once.
+
+        Parameters
+        ----------
+        years : ndarray
+            The time axis (n)
+        data : ndarray
+            The period values (n, cells) without nan
+
+        Returns
+        ----------
+        result : dict
+            "trend_slope", "trend_intercept", "trend_pvalue",
+            "sen_slope" and "mk_pvalue" per cell
+        '''
+        n = len(years)
+
+        # Closed form least squares
+        xm = years - years.mean()
+        sxx = np.dot(xm, xm)
+        slope = np.dot(xm, data) / sxx
+        intercept = data.mean(axis=0) - slope * years.mean()
+
+        residuals = data - (intercept + slope * years[:, np.newaxis])
+        sse = (residuals * residuals).sum(axis=0)
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            t = slope / np.sqrt(sse / (n - 2) / sxx)
+
+        pvalue = self.__tTestPValue(t, n - 2)
+
+        # Mann-Kendall S, tie corrected variance and Sen's slope
+        s = np.zeros(data.shape[1])
+        ties = np.zeros(data.shape[1])
+        pairSlopes = []
+
+        for i in range(n):
+            diff = data[i+1:] - data[i]
+            s += np.sign(diff).sum(axis=0)
+
+            c = (data == data[i]).sum(axis=0)
+            ties += (c - 1) * (2 * c + 5)
+
+            if i < n - 1:
+                pairSlopes.append(diff / (years[i+1:] - years[i])[:, np.newaxis])
+
+        senSlope = np.median(np.concatenate(pairSlopes, axis=0), axis=0)
+
+        varS = (n * (n - 1) * (2 * n + 5) - ties) / 18.0
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            z = np.where(varS > 0, (s - np.sign(s)) / np.sqrt(varS), 0)
+
+        mkPvalue = np.vectorize(math.erfc, otypes=[np.float64])(np.abs(z) / math.sqrt(2))
+
+        return {"trend_slope": slope, "trend_intercept": intercept, "trend_pvalue": pvalue,
+                "sen_slope": senSlope, "mk_pvalue": mkPvalue}
+
+
+    def __tTestPValue(self, t, dof):
+        '''
+        Two-sided p-value of Student's t distribution with
+        integer degrees of freedom (closed form series, see
+        Abramowitz & Stegun 26.7.3 and 26.7.4).
+
+        Parameters
+        ----------
+        t : ndarray
+            The t statistics
+        dof : int
+            Degrees of freedom
+
+        Returns
+        ----------
+        p : ndarray
+            The p-values
+        '''
+        t = np.abs(t)
+        perfect = np.isinf(t)
+        t = np.where(perfect, 0, t)
+
+        theta = np.arctan(t / math.sqrt(dof))
+        cos2 = np.cos(theta) ** 2
+
+        if dof % 2 == 1:
+            term = np.ones_like(theta)
+            series = np.ones_like(theta) if dof > 1 else np.zeros_like(theta)
+
+            for k in range(3, dof - 1, 2):
+                term = term * cos2 * (k - 1) / float(k)
+                series += term
+
+            if dof > 1:
+                series *= np.cos(theta)
+
+            a = 2 / math.pi * (theta + np.sin(theta) * series)
+        else:
+            term = np.ones_like(theta)
+            series = np.ones_like(theta)
+
+            for k in range(2, dof - 1, 2):
+                term = term * cos2 * (k - 1) / float(k)
+                series += term
+
+            a = np.sin(theta) * series
+
+        p = np.clip(1 - a, 0, 1)
+        p[perfect] = 0
+
+        return p
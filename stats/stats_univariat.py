@@ -1,10 +1,14 @@
 import numpy as np
 import pandas as pd
+import warnings
 from datetime import *
 import calendar
 from csv_manager import *
 from point_manager import *
+from resource_estimator import ResourceEstimator
 import pickle
+import threading
+import Queue
 
 class StatsUnivariat(object):    
     '''
@@ -25,6 +29,11 @@ class StatsUnivariat(object):
         self.varsToBeAnalysed = []
         self.ofPath = self.setOfPath(ofPath)
         self.fn = ""
+        self.memoryBudget = None
+        self.maxWorkers = None
+        self.tuning = {"tileRows": None, "prefetchDepth": 0}
+        self.bulkFlag = False
+        self.bulkBlockBytes = 512 * 1024**2
 
 
     def setOfPath(self, path):
@@ -37,6 +46,219 @@ class StatsUnivariat(object):
     def setFilename(self, fn):
         self.fn = fn
         
+        
+    def setMemoryBudget(self, memoryBudget, maxWorkers=None):
+        '''
+        Sets a memory budget for calcAll(). Before the 
+        calculation the resources are estimated and the 
+        row bands and the prefetch depth are chosen to fit 
+        the budget (see resource_estimator.ResourceEstimator).
+        
+        Parameters
+        ----------
+        memoryBudget : int
+            The memory budget in bytes
+        maxWorkers : int
+            The maximum number of workers for the recommendation
+            of the number of tiles
+        '''
+        self.memoryBudget = memoryBudget
+        self.maxWorkers = maxWorkers
+        
+
+    def setBulkMode(self, bulk=True, blockBytes=512 * 1024**2):
+        '''
+        Enables the bulk mode for count, sum and mean. The
+        analysed time range is read in large blocks of 
+        consecutive periods instead of period by period, all
+        periods of a block are reduced at once with segment
+        reductions (np.add.reduceat) and written with one 
+        call. Meant for small and medium grids. Variables 
+        which are not suited (other functions, packed I/O, 
+        overlapping periods) are calculated period by period.
+        
+        Parameters
+        ----------
+        bulk : bool
+            Enables or disables the bulk mode
+        blockBytes : int
+            The memory budget of one block in bytes. A block
+            contains at least one period. Limited by the 
+            memory budget (see setMemoryBudget()).
+        '''
+        self.bulkFlag = bulk
+        self.bulkBlockBytes = blockBytes
+        
+        
+    def __calcBulk(self, varName, varToBeAnalysed, funcToBeApplied, csv):
+        '''        
+        Calculates the statistics of all periods in blocks.
+        Each block is read at once (from the start of its
+        first to the end of its last period), the days to
+        analyse are selected in memory and the periods are
+        reduced along the segment boundaries.
+        
+        Parameters
+        ----------
+        varName : string
+            Variable name
+        varToBeAnalysed : netCDF4._netCDF4.Variable
+            Raw nc variable
+        funcToBeApplied : dict
+            The univariate function name and properties
+        csv : csv_manager.Csv
+            Manages the csv output
+            
+        Returns
+        ----------
+        done : bool
+            False if the variable is not suited for the bulk
+            mode and has to be calculated period by period
+        '''
+        nc_manager = self.nc_manager
+        
+        if funcToBeApplied["name"] not in ("count", "sum", "mean") or (nc_manager.packedIOFlag and not nc_manager.subDailyFlag):
+            return False
+            
+        ncVarName = nc_manager.createOutputVarName(varName, funcToBeApplied)
+        periods = [(i,) + nc_manager.getPeriodRange(p)
+                   for i, p in enumerate(nc_manager.spanStartSpanEnd) if not nc_manager.isCompleted(ncVarName, i)]
+                   
+        if any(periods[k+1][1] < periods[k][2] for k in range(len(periods) - 1)):
+            return False
+            
+        ny, nx = nc_manager.getWindowShape()
+        blockBytes = self.bulkBlockBytes if self.memoryBudget is None else min(self.bulkBlockBytes, self.memoryBudget)
+        maxDays = max(1, int(blockBytes // (ny * nx * 8 * 3)))
+        
+        # A block holds at least one period, periods exceeding the budget are read in row bands
+        if self.memoryBudget is not None and any(endIdx - startIdx > maxDays for i, startIdx, endIdx in periods):
+            return False
+            
+        print("Calculating variable (bulk): " + varName)
+        
+        for block in self.__bulkBlocks(periods, maxDays):
+            blockStart, blockEnd = block[0][1], block[-1][2]
+            
+            # Only the days of the periods of the block which are to be analysed
+            select = np.zeros(blockEnd - blockStart, dtype=bool)
+            
+            for i, startIdx, endIdx in block:
+                select[startIdx-blockStart:endIdx-blockStart] = nc_manager.boolDateVec[startIdx:endIdx]
+                
+            lengths = [int(select[startIdx-blockStart:endIdx-blockStart].sum()) for i, startIdx, endIdx in block]
+            data = nc_manager.readSlab(varToBeAnalysed, blockStart, blockEnd)[select]
+            
+            results = nc_manager.scatterActive(self.calcSegments(funcToBeApplied, data, lengths))
+            
+            for k, (i, startIdx, endIdx) in enumerate(block):
+                self.collectPointValues(varName, results[k], csv)
+                
+            nc_manager.writeToOutputFile(ncVarName, slice(block[0][0], block[-1][0] + 1), results)
+            
+            for i, startIdx, endIdx in block:
+                nc_manager.markCompleted(ncVarName, i, csv)
+                
+        return True
+        
+        
+    def __bulkBlocks(self, periods, maxDays):
+        '''
+        Groups the periods into blocks of consecutive steps
+        which span at most maxDays days (at least one period).
+        '''
+        blocks = []
+        
+        for period in periods:
+            if blocks and period[0] == blocks[-1][-1][0] + 1 and period[2] - blocks[-1][0][1] <= maxDays:
+                blocks[-1].append(period)
+            else:
+                blocks.append([period])
+                
+        return blocks
+        
+        
+    def calcSegments(self, func, data, lengths):
+        '''        
+        Calculates count, sum or mean for consecutive 
+        segments (periods) of the data at once with segment
+        reductions. The results are the same as the ones of 
+        calcCount(), calcSum() and calcMean() per segment: 
+        nan values propagate into counts and sums, values 
+        which do not meet the condition are excluded from 
+        sums (nan) and means.
+        
+        Parameters
+        ----------
+        func : dict
+            Dict with information about the statistical 
+            function to be applied like name and properties
+        data : ndarray
+            The data of all segments along the first axis
+        lengths : list
+            The number of days of each segment
+            
+        Returns
+        ----------
+        result : ndarray
+            Array with one result frame per segment
+        '''
+        funcName = func["name"]
+        lengths = np.asarray(lengths, dtype=int)
+        offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        nonEmpty = lengths > 0
+        data = np.asarray(data, dtype=np.float64)
+        
+        if not func["props"]:
+            keep = None
+        elif func["props"][0] is True:
+            try:
+                sign = func["props"][1]
+            except:
+                raise ValueError("Sign not set. Leave function properties empty or choose a sign (<,>,<=,>=) and value") 
+    
+            try:
+                val = func["props"][2]
+            except:
+                raise ValueError("No value set. Leave function properties empty or choose a value") 
+                
+            if sign == '<':
+                keep = data < val
+            elif sign == '>':
+                keep = data > val
+            elif sign == '<=':
+                keep = data <= val
+            elif sign == '>=':
+                keep = data >= val
+            else:
+                raise ValueError("Wrong sign chosen. Available sign are (<,>,<=,>=)") 
+        
+        if funcName == "count":
+            if keep is None:
+                values = np.ones_like(data)
+            else:
+                values = np.where(np.isnan(data), np.nan, keep)
+        else:
+            values = data if keep is None else np.where(keep, data, np.nan)
+            
+        result = np.zeros((len(lengths),) + data.shape[1:])
+        
+        if funcName == "mean":
+            valid = ~np.isnan(values)
+            
+            if nonEmpty.any():
+                sums = np.add.reduceat(np.where(valid, values, 0), offsets[nonEmpty], axis=0)
+                counts = np.add.reduceat(valid, offsets[nonEmpty], axis=0)
+                
+                with np.errstate(invalid="ignore", divide="ignore"):
+                    result[nonEmpty] = sums / counts
+                    
+            result[~nonEmpty] = np.nan
+        elif nonEmpty.any():
+            result[nonEmpty] = np.add.reduceat(values, offsets[nonEmpty], axis=0)
+            
+        return result
+
 
     def __calc(self, varName, varToBeAnalysed, funcToBeApplied, csv):
         '''        
@@ -62,38 +284,165 @@ class StatsUnivariat(object):
         
         print("Calculating variable: " + varName)
 
-        for i, period in enumerate(nc_manager.spanStartSpanEnd):
-            
-            periodStartIdx = nc_manager.sourceDatesIdx[period["startDate"]]
-            periodEndIdx = nc_manager.sourceDatesIdx[period["endDate"]]
+        ncVarName = nc_manager.createOutputVarName(varName, funcToBeApplied)
+        rawFlag = nc_manager.packedIOFlag and not nc_manager.subDailyFlag
+        
+        if rawFlag:
+            packing = nc_manager.getPacking(varToBeAnalysed)
+
+        periods = [(i, period) for i, period in enumerate(nc_manager.spanStartSpanEnd) if not nc_manager.isCompleted(ncVarName, i)]
+        ny = nc_manager.getWindowShape()[0]
+        slabs = self.__readPeriods(varToBeAnalysed, periods, rawFlag)
+        
+        try:
+            for i, rows, data in slabs:
+                bandResult = self.applyFunc(varName, funcToBeApplied, data, packing if rawFlag else None)
+                
+                if rows is None:
+                    result = bandResult
+                else:
+                    if rows[0] == 0:
+                        result = np.empty((ny,) + bandResult.shape[1:], dtype=bandResult.dtype)
+                        
+                    result[rows[0]:rows[1]] = bandResult
+                    
+                    if rows[1] < ny:
+                        continue
+                        
+                result = nc_manager.scatterActive(result)
+                
+                self.collectPointValues(varName, result, csv)
+                
+                nc_manager.writeToOutputFile(ncVarName, i, result)
+                nc_manager.markCompleted(ncVarName, i, csv)
+        finally:
+            # Stops the prefetch thread if the reduction or the writing fails
+            slabs.close()
 
-            boolArr = nc_manager.boolDateVec[periodStartIdx:periodEndIdx]
-            data = varToBeAnalysed[periodStartIdx:periodEndIdx][boolArr]
 
-            timestepStr = str(period["startDate"]) + " - " + str(period["endDate"]) # Timestep string for .csv output
+    def __readPeriods(self, variable, periods, raw):
+        '''        
+        Reads the period slabs (date filtered) of a variable,
+        in bands of rows if tileRows is set by the tuning. 
+        With a prefetch depth > 0 the slabs are read ahead in
+        a background thread while the current slab is reduced.
+        The thread is stopped and joined when the generator 
+        is closed, also if the consumer fails.
+        
+        Parameters
+        ----------
+        variable : netCDF4._netCDF4.Variable
+            Raw nc variable
+        periods : list
+            The (step, period) tuples to read
+        raw : bool
+            Read packed data on the raw scale
             
-            funcName = funcToBeApplied["name"] 
-            funcProps = funcToBeApplied["props"]
+        Returns
+        ----------
+        units : generator
+            (step, rows, data) per period and band. rows is
+            None if the whole window is read at once
+        '''
+        nc_manager = self.nc_manager
+        tileRows = self.tuning["tileRows"]
+        prefetchDepth = self.tuning["prefetchDepth"]
+        
+        if tileRows is None or nc_manager.activeCellsFlag:
+            bands = [None]
+        else:
+            ny = nc_manager.getWindowShape()[0]
+            bands = [(r, min(r + tileRows, ny)) for r in range(0, ny, tileRows)]
             
-            if funcName == "count":
-                result = self.calcCount(funcToBeApplied, data)
-            elif funcName == "sum":
-                result = self.calcSum(funcToBeApplied, data)
-            elif funcName == "mean":
-                result = self.calcMean(funcToBeApplied, data)
-            else:
-                raise ValueError("Function '" + funcToBeApplied + "' to be applied on variable '" + varName + "' not known.")
+        units = [(i, period, rows) for i, period in periods for rows in bands]
+        
+        def read(unit):
+            i, period, rows = unit
+            periodStartIdx, periodEndIdx = nc_manager.getPeriodRange(period)
+            boolArr = nc_manager.boolDateVec[periodStartIdx:periodEndIdx]
             
-            for point in self.point_manager.pointsContainer:
-                val = point.extractPtVal(result)
-                csv.collectValues(varName, val, point)
+            return nc_manager.readSlab(variable, periodStartIdx, periodEndIdx, raw=raw, rows=rows)[boolArr]
             
-            if funcProps:
-                ncVarName = varName + "_[" + funcName + "_" + funcProps[1] + "_" + str(funcProps[2]) + "]"
-            else:
-                ncVarName = varName + "_[" + funcName + "]"
+        if prefetchDepth == 0:
+            for unit in units:
+                yield unit[0], unit[2], read(unit)
+            return
+            
+        slabs = Queue.Queue(maxsize=prefetchDepth)
+        stop = threading.Event()
+        
+        def put(item):
+            # Waits for a free slot until the consumer stops
+            while not stop.is_set():
+                try:
+                    slabs.put(item, timeout=0.1)
+                    return True
+                except Queue.Full:
+                    pass
+                    
+            return False
+        
+        def prefetch():
+            try:
+                for unit in units:
+                    if not put((unit, read(unit), None)):
+                        return
+            except Exception as e:
+                put((None, None, e))
+                
+        thread = threading.Thread(target=prefetch)
+        thread.daemon = True
+        thread.start()
+        
+        try:
+            for _ in units:
+                unit, data, error = slabs.get()
                 
-            nc_manager.writeToOutputFile(ncVarName, i, result)
+                if error is not None:
+                    raise error
+                    
+                yield unit[0], unit[2], data
+        finally:
+            stop.set()
+            thread.join()
+
+
+    def applyFunc(self, varName, funcToBeApplied, data, packing=None):
+        '''        
+        Applies the univariate function to the data of
+        one period.
+        
+        Parameters
+        ----------
+        varName : string
+            Variable name
+        funcToBeApplied : dict
+            The univariate function name and properties
+        data : ndarray
+            The data of the period
+        packing : tuple
+            The packing parameters for raw (packed) data, 
+            None if the data is unpacked
+            
+        Returns
+        ----------
+        result : ndarray
+            The reduced data
+        '''
+        funcName = funcToBeApplied["name"] 
+        
+        if packing is not None and funcName in ("count", "sum", "mean"):
+            result = self.calcMasked(funcToBeApplied, data, packing)
+        elif funcName == "count":
+            result = self.calcCount(funcToBeApplied, data)
+        elif funcName == "sum":
+            result = self.calcSum(funcToBeApplied, data)
+        elif funcName == "mean":
+            result = self.calcMean(funcToBeApplied, data)
+        else:
+            raise ValueError("Function '" + funcName + "' to be applied on variable '" + varName + "' not known.")
+            
+        return result
 
 
     def calcAll(self):
@@ -107,7 +456,18 @@ class StatsUnivariat(object):
         if not varsToBeAnalysed:
             print('There is no Variable to analyse.')
         
-        csv = CsvManager(self.nc_manager.workingDir, self.nc_manager.spanStartSpanEnd, varsToBeAnalysed, self.point_manager.pointsContainer, self.fn)
+        if self.memoryBudget is not None:
+            estimator = ResourceEstimator(self.nc_manager)
+            self.tuning = estimator.tune(varsToBeAnalysed, self.memoryBudget, self.maxWorkers)
+            estimator.printReport(self.tuning)
+            
+            if self.nc_manager.activeCellsFlag and self.tuning["tileRows"] is not None:
+                warnings.warn("Row bands are not available with active cells. The active box is read at once per period and may exceed the memory budget.", UserWarning)
+            
+        csv = CsvManager(self.nc_manager.workingDir, self.nc_manager.spanStartSpanEnd, varsToBeAnalysed, self.getPoints(), self.fn)
+        
+        if self.nc_manager.checkpoint is not None:
+            csv.setPartials(self.nc_manager.checkpoint["csv"])
         
         for var in varsToBeAnalysed:
             varName = var["var"]
@@ -116,11 +476,55 @@ class StatsUnivariat(object):
             if varName != "skip":
                 data = var["data"]
                 func = var["func"]   
+                
+                if self.bulkFlag and self.__calcBulk(varName, data, func, csv):
+                    continue
+                    
                 if self.__calc(varName, data, func, csv) == 0:
                     return 0
 
-        csv.writeDataToFile()
-        self.nc_manager.dst.close()
+        csv.writeDataToFile(append=self.nc_manager.incrementalFlag)
+        self.nc_manager.closeOutputFile()
+        self.nc_manager.removeCheckpoint()
+
+
+    def getPoints(self):
+        '''        
+        Returns the points which lie inside the analysed
+        tile (all points if the whole grid is analysed).
+        '''
+        nc_manager = self.nc_manager
+        points = []
+        
+        for point in self.point_manager.pointsContainer:
+            coords = point.getPointCoords()
+            
+            if nc_manager.toLocalIndex(coords["yIdx"], coords["xIdx"]) is not None:
+                points.append(point)
+                
+        return points
+        
+        
+    def collectPointValues(self, varName, result, csv):
+        '''        
+        Extracts the values of the points from the result
+        frame and passes them to the csv collector.
+        
+        Parameters
+        ----------
+        varName : string
+            Variable name
+        result : ndarray
+            The result frame (y, x)
+        csv : csv_manager.Csv
+            Manages the csv output
+        '''
+        nc_manager = self.nc_manager
+        
+        for point in self.getPoints():
+            coords = point.getPointCoords()
+            val = point.extractPtVal(result, nc_manager.toLocalIndex(coords["yIdx"], coords["xIdx"]))
+            csv.collectValues(varName, val, point)
 
 
     def calcCount(self, func, data):
@@ -282,6 +686,95 @@ class StatsUnivariat(object):
         return mean_
 
 
+    def calcMasked(self, func, data, packing):
+        '''        
+        Calculates count, sum or mean directly on the raw
+        (packed) data. Fill values are excluded with a 
+        boolean mask and thresholds are converted to the
+        raw scale, so the data is never unpacked to float.
+        Sums of cells without any valid value and means
+        without any selected value are set to nan.
+        
+        Parameters
+        ----------
+        func : dict
+            Dict with information about the statistical 
+            function to be applied like name and properties
+        data : ndarray
+            Three dimensional array with the raw dataframes
+        packing : tuple
+            (scale_factor, add_offset, fill value) as returned
+            by NcManager.getPacking()
+            
+        Returns
+        ----------
+        result : ndarray
+            Array with the count, sum or mean in physical units
+        '''
+        scale, offset, fill = packing
+        
+        if fill is None:
+            valid = np.ones(data.shape, dtype=bool)
+        else:
+            valid = data != fill
+            
+        if data.dtype.kind == "f":
+            valid &= ~np.isnan(data)
+            
+        nValid = np.sum(valid, axis = 0)
+            
+        if not func["props"]:
+            pass
+        elif func["props"][0] is True:
+            try:
+                sign = func["props"][1]
+            except:
+                raise ValueError("Sign not set. Leave function properties empty or choose a sign (<,>,<=,>=) and value") 
+    
+            try:
+                val = func["props"][2]
+            except:
+                raise ValueError("No value set. Leave function properties empty or choose a value") 
+                
+            # Threshold on the raw scale. A negative scale factor flips the comparison.
+            rawVal = (val - offset) / float(scale)
+            
+            if scale < 0:
+                sign = {"<": ">", ">": "<", "<=": ">=", ">=": "<="}.get(sign, sign)
+                
+            if sign == '<':
+                valid &= data < rawVal
+            elif sign == '>':
+                valid &= data > rawVal
+            elif sign == '<=':
+                valid &= data <= rawVal
+            elif sign == '>=':
+                valid &= data >= rawVal
+            else:
+                raise ValueError("Wrong sign chosen. Available sign are (<,>,<=,>=)") 
+                
+        count = np.sum(valid, axis = 0)
+        
+        if func["name"] == "count":
+            return count
+            
+        accType = np.int64 if data.dtype.kind in "iu" else np.float64
+        rawSum = np.sum(np.where(valid, data, 0), axis = 0, dtype = accType)
+        
+        with np.errstate(invalid="ignore", divide="ignore"):
+            if func["name"] == "sum":
+                result = rawSum * float(scale) + offset * count
+            else:
+                result = rawSum / count.astype(np.float64) * scale + offset
+        
+        if func["name"] == "sum":
+            result = np.where(nValid > 0, result, np.nan)
+        else:
+            result = np.where(count > 0, result, np.nan)
+                
+        return result
+
+
     def setVariablesToAnalyse(self, vars_):
         '''        
         Stores the variables to be analyses and
@@ -291,7 +784,9 @@ class StatsUnivariat(object):
         ----------
         vars_ : ndarray
             Array of dicts with varname and statics
-            function to be applied.
+            function to be applied. The optional key
+            "resample" sets how sub-daily data is 
+            aggregated to daily values (mean, sum, min, max)
         '''            
         # Appends the netCDF src variable. 
         nc_manager = self.nc_manager
@@ -302,9 +797,20 @@ class StatsUnivariat(object):
             try:
                 i["data"] = nc_manager.src.variables[i["var"]]
                 self.varShape = i["data"][0].shape
+                
+                if "resample" in i:
+                    nc_manager.setResampleMethod(i["var"], i["resample"])
 
             except KeyError as e: 
                 print("Variable '" + i["var"] + "' not found in datafile. Continues with next variable...")
                 i["var"] = "skip"
         
-        nc_manager.initializeOutputFile(self.ofPath, vars_)
+        self.initializeOutput(vars_)
+        
+        
+    def initializeOutput(self, vars_):
+        '''        
+        Initializes the output file for the variables
+        to be analysed.
+        '''
+        self.nc_manager.initializeOutputFile(self.ofPath, vars_)
@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import numpy as np
+from netCDF4 import Dataset
+import argparse
+
+class TileManager(object):
+    '''
+    Class for splitting a grid into spatial tiles (shards)
+    and for merging the partial output files of the tiles
+    into the final output file. Every tile is analysed by
+    an independent process which writes its own output
+    (see NcManager.setTile()).
+    '''
+    def createTiles(self, ny, nx, tilesY, tilesX, chunks=None):
+        '''
+        Splits a grid into tilesY x tilesX tiles of about
+        the same size.
+
+        Parameters
+        ----------
+        ny, nx : int
+            The grid shape
+        tilesY, tilesX : int
+            The number of tiles in y and x direction
+        chunks : tuple
+            The chunk size (cy, cx) of a chunk store. The tile
+            edges are then aligned to the chunks (see
+            NcManager.enableChunkStore())
+
+        Returns
+        ----------
+        tiles : list
+            The tiles as (y0, y1, x0, x1) tuples, to be
+            passed to NcManager.setTile()
+        '''
+        yEdges = np.linspace(0, ny, tilesY + 1).astype(int)
+        xEdges = np.linspace(0, nx, tilesX + 1).astype(int)
+
+        if chunks is not None:
+            yEdges = np.minimum(np.round(yEdges / float(chunks[0])).astype(int) * chunks[0], ny)
+            xEdges = np.minimum(np.round(xEdges / float(chunks[1])).astype(int) * chunks[1], nx)
+            yEdges[-1], xEdges[-1] = ny, nx
+
+        tiles = []
+
+        for i in range(tilesY):
+            for j in range(tilesX):
+                if yEdges[i] < yEdges[i+1] and xEdges[j] < xEdges[j+1]:
+                    tiles.append((int(yEdges[i]), int(yEdges[i+1]), int(xEdges[j]), int(xEdges[j+1])))
+
+        return tiles
+
+
+    def mergeTiles(self, tilePaths, outputPath):
+        '''
+        Assembles the partial output files of the tiles into
+        the final output file. The metadata and time bounds of
+        all tiles have to be identical and the tiles have to
+        cover the grid completely without overlapping.
+
+        Parameters
+        ----------
+        tilePaths : list
+            The paths of the partial output files
+        outputPath : string
+            The path of the merged output file
+        '''
+        tiles = [Dataset(path, mode="r") for path in tilePaths]
+
+        try:
+            gridShape = self.checkTiles(tiles, tilePaths)
+            self.__writeMerged(tiles, outputPath, gridShape)
+        finally:
+            for tile in tiles:
+                tile.close()
+
+        print("Merged " + str(len(tiles)) + " tiles into " + outputPath)
+
+
+    def checkTiles(self, tiles, tilePaths):
+        '''
+        Checks that the tiles belong to the same run and
+        cover the whole grid exactly once.
+
+        Parameters
+        ----------
+        tiles : list
+            The opened partial output files
+        tilePaths : list
+            The paths of the partial output files
+
+        Returns
+        ----------
+        gridShape : tuple
+            The shape (ny, nx) of the whole grid
+        '''
+        if not tiles:
+            raise ValueError("No tiles to merge.")
+
+        first = tiles[0]
+        gridShape = tuple(int(i) for i in first.getncattr("grid_shape"))
+        coverage = np.zeros(gridShape, dtype=int)
+
+        for tile, path in zip(tiles, tilePaths):
+            if "tile_window" not in tile.ncattrs():
+                raise ValueError("'" + path + "' is not a tile output (no tile_window attribute).")
+
+            if "grid_stride" in tile.ncattrs():
+                raise ValueError("'" + path + "' was written with a stride and cannot be merged.")
+
+            if tuple(int(i) for i in tile.getncattr("grid_shape")) != gridShape:
+                raise ValueError("Grid shape of '" + path + "' differs from '" + tilePaths[0] + "'.")
+
+            if sorted(tile.variables) != sorted(first.variables):
+                raise ValueError("Variables of '" + path + "' differ from '" + tilePaths[0] + "'.")
+
+            for name, variable in tile.variables.items():
+                ref = first.variables[name]
+
+                if variable.dimensions != ref.dimensions or variable.dtype != ref.dtype:
+                    raise ValueError("Variable '" + name + "' of '" + path + "' differs from '" + tilePaths[0] + "'.")
+
+                if {k: str(variable.getncattr(k)) for k in variable.ncattrs()} != {k: str(ref.getncattr(k)) for k in ref.ncattrs()}:
+                    raise ValueError("Metadata of variable '" + name + "' of '" + path + "' differs from '" + tilePaths[0] + "'.")
+
+            if not np.array_equal(tile.variables["time_bnds"][:], first.variables["time_bnds"][:]):
+                raise ValueError("time_bnds of '" + path + "' differ from '" + tilePaths[0] + "'.")
+
+            y0, y1, x0, x1 = self.__window(tile)
+            coverage[y0:y1, x0:x1] += 1
+
+        if (coverage == 0).any():
+            raise ValueError("Tiles do not cover the whole grid. " + str(int((coverage == 0).sum())) + " cells are missing.")
+
+        if (coverage > 1).any():
+            raise ValueError("Tiles overlap. " + str(int((coverage > 1).sum())) + " cells are covered more than once.")
+
+        return gridShape
+
+
+    def __window(self, tile):
+        return tuple(int(i) for i in tile.getncattr("tile_window"))
+
+
+    def __writeMerged(self, tiles, outputPath, gridShape):
+        '''
+        Creates the merged output file with the metadata
+        of the first tile and copies the data of each tile
+        into its window.
+        '''
+        first = tiles[0]
+        dst = Dataset(outputPath, 'w', format="NETCDF4")
+        dst.set_auto_maskandscale(False)
+
+        try:
+            dst.setncatts({k: first.getncattr(k) for k in first.ncattrs() if k not in ("tile_window", "grid_shape")})
+
+            for name, dimension in first.dimensions.items():
+                if name == "y":
+                    size = gridShape[0]
+                elif name == "x":
+                    size = gridShape[1]
+                else:
+                    size = None if dimension.isunlimited() else len(dimension)
+
+                dst.createDimension(name, size)
+
+            for name, variable in first.variables.items():
+                attrs = {k: variable.getncattr(k) for k in variable.ncattrs()}
+                fill = attrs.pop("_FillValue", None)
+
+                varOut = dst.createVariable(name, variable.datatype, variable.dimensions, fill_value=fill)
+                varOut.setncatts(attrs)
+
+            for tile in tiles:
+                tile.set_auto_maskandscale(False)
+                y0, y1, x0, x1 = self.__window(tile)
+
+                for name, variable in tile.variables.items():
+                    dims = variable.dimensions
+
+                    if "y" not in dims and "x" not in dims:
+                        if tile is first:
+                            dst.variables[name][:] = variable[:]
+                        continue
+
+                    idx = tuple(slice(y0, y1) if d == "y" else slice(x0, x1) if d == "x" else slice(None) for d in dims)
+
+                    # Copy step by step along a leading non spatial dimension to bound memory
+                    if dims[0] not in ("y", "x") and len(dims) > 1:
+                        for step in range(variable.shape[0]):
+                            dst.variables[name][(step,) + idx[1:]] = variable[step]
+                    else:
+                        dst.variables[name][idx] = variable[:]
+        finally:
+            dst.close()
+
+
+if __name__== "__main__":
+    parser = argparse.ArgumentParser(description="Merges the partial output files of a sharded run.")
+    parser.add_argument("output", help="Path of the merged output file")
+    parser.add_argument("tiles", nargs="+", help="Paths of the tile output files")
+    args = parser.parse_args()
+
+    TileManager().mergeTiles(args.tiles, args.output)